@@ -6,9 +6,34 @@ import {useRoute} from "@react-navigation/native";
 import Webcam from "react-webcam";
 import {PYTHON_URL} from "@env";
 
+const JOB_POLL_INTERVAL_MS = 2000;
+const JOB_TIMEOUT_MS = 15 * 60 * 1000;
+
+type UploadResponse = {status: number; data: any};
+
+// The server answers 202 and trains in a background job, poll it until it is done
+const waitForEnrolment = async (response: UploadResponse) => {
+  if (response.status === 200) {
+    return {success: true, message: "Video uploaded successfully!"};
+  }
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    const {data: job} = await axios.get(`${PYTHON_URL}/jobs/${response.data.jobId}`);
+    if (job.status === "succeeded") {
+      return {success: true, message: "Face enrolment completed!"};
+    }
+    if (job.status === "failed") {
+      return {success: false, message: job.error || "Face enrolment failed"};
+    }
+  }
+  return {success: false, message: "Face enrolment is still running, please check again later"};
+};
+
 const FaceScanScreen = () => {
   const [videoPath, setVideoPath] = useState<string | null>(null);
   const [isRecording, setIsRecording] = useState(false);
+  const [isProcessing, setIsProcessing] = useState(false);
   const route = useRoute();
   const {userId} = route.params as {userId: string};
   const webcamRef = useRef<Webcam>(null);
@@ -38,6 +63,24 @@ const FaceScanScreen = () => {
     }
   };
 
+  const reportUpload = async (response: UploadResponse) => {
+    if (response.status !== 200 && response.status !== 202) {
+      console.error("Upload error response:", response.data);
+      Alert.alert("Error", "Failed to upload video");
+      return;
+    }
+    setIsProcessing(true);
+    try {
+      const result = await waitForEnrolment(response);
+      Alert.alert(result.success ? "Success" : "Error", result.message);
+    } catch (error) {
+      console.error("Job status error:", error);
+      Alert.alert("Error", "Could not get the face enrolment status");
+    } finally {
+      setIsProcessing(false);
+    }
+  };
+
   const handleUpload = async () => {
     let formData = new FormData();
     console.log(PYTHON_URL);
@@ -54,17 +97,18 @@ const FaceScanScreen = () => {
               headers: {"Content-Type": "multipart/form-data"},
             }
           );
-          if (responseUpload.status === 200) {
-            Alert.alert("Success", "Video uploaded successfully!");
-          } else {
-            Alert.alert("Error", "Failed to upload video");
-          }
+          await reportUpload(responseUpload);
         } catch (error) {
-          Alert.alert("Error", "Failed to upload video");
+          Alert.alert(
+            "Error",
+            (axios.isAxiosError(error) && error.response?.data?.error) ||
+              "Failed to upload video"
+          );
         }
       } else {
         Alert.alert("Error", "No video to upload");
       }
+      return;
     } else {
       if (videoPath) {
         const fileName = videoPath.split("/").pop();
@@ -97,12 +141,7 @@ const FaceScanScreen = () => {
         },
       });
 
-      if (responseUpload.status === 200) {
-        Alert.alert("Success", "Video uploaded successfully!");
-      } else {
-        console.error("Upload error response:", responseUpload.data);
-        Alert.alert("Error", "Failed to upload video");
-      }
+      await reportUpload(responseUpload);
     } catch (error) {
       if (axios.isAxiosError(error)) {
         console.error(
@@ -111,7 +150,9 @@ const FaceScanScreen = () => {
         );
         Alert.alert(
           "Error",
-          error.response?.data?.message || "Failed to upload video"
+          error.response?.data?.error ||
+            error.response?.data?.message ||
+            "Failed to upload video"
         );
       } else {
         console.error("Upload error:", error);
@@ -166,7 +207,14 @@ const FaceScanScreen = () => {
       ) : (
         <Button title="Record Video" onPress={pickVideo} />
       )}
-      {videoPath && <Button title="Upload Video" onPress={handleUpload} />}
+      {videoPath && (
+        <Button
+          title="Upload Video"
+          onPress={handleUpload}
+          disabled={isProcessing}
+        />
+      )}
+      {isProcessing && <Text>Processing video, this can take a few minutes...</Text>}
     </View>
   );
 };
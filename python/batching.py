@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+import numpy as np
+
+class _Request:
+    def __init__(self, model, image):
+        self.model = model
+        self.image = image
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher:
+    # Collects concurrent single-image predictions for up to max_wait_ms, groups them
+    # by model and runs one compiled call per group instead of one predict() per image
+    def __init__(self, max_batch_size=16, max_wait_ms=5, window=1000, max_functions=32):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        # model -> traced function. The function holds its model, so entries are dropped
+        # by forget() when the model registry evicts a model, and by LRU past max_functions.
+        self.functions = OrderedDict()
+        self.max_functions = max_functions
+        self.lock = threading.Lock()
+        self.thread = None
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.requests_served = 0
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+                self.thread.start()
+
+    def predict(self, model, image):
+        # Returns the model output for a single (64, 64, 1) image
+        self._start()
+        request = _Request(model, np.asarray(image, dtype=np.float32))
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _function(self, model):
+        # Models that are not Keras models (TFLite exports) take the whole batch in predict
+        if not hasattr(model, 'get_weights'):
+            return model.predict
+
+        # Only Keras models need TensorFlow, imported here so the batcher itself does not
+        import tensorflow as tf
+
+        # One traced graph per model, the batch dimension stays dynamic so it is traced once
+        with self.lock:
+            function = self.functions.get(model)
+            if function is not None:
+                self.functions.move_to_end(model)
+                return function
+
+        signature = tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32)
+        function = tf.function(lambda inputs: model(inputs, training=False), input_signature=[signature])
+        with self.lock:
+            self.functions[model] = function
+            while len(self.functions) > self.max_functions:
+                self.functions.popitem(last=False)
+        return function
+
+    def forget(self, model):
+        # Drops the traced function of a model that is no longer served, so the model can be freed
+        with self.lock:
+            self.functions.pop(model, None)
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            groups = {}
+            for request in batch:
+                groups.setdefault(id(request.model), []).append(request)
+
+            for group in groups.values():
+                try:
+                    outputs = self._function(group[0].model)(np.stack([request.image for request in group]))
+                    outputs = np.asarray(outputs)
+                    for request, output in zip(group, outputs):
+                        request.result = output
+                except Exception as e:
+                    for request in group:
+                        request.error = e
+
+                finished = time.perf_counter()
+                with self.lock:
+                    self.batch_sizes[len(group)] += 1
+                    self.requests_served += len(group)
+                    self.latencies.extend(finished - request.enqueued for request in group)
+                for request in group:
+                    request.done.set()
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            served = self.requests_served
+
+        batches = sum(batch_sizes.values())
+        return {
+            "requests": served,
+            "batches": batches,
+            "mean_batch_size": served / batches if batches else 0.0,
+            "batch_sizes": batch_sizes,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,772 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+SAMPLE_FACES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faces', 'unknown')
+
+def rotate_image_loop(image, angle):
+    # Reference per-pixel implementation that rotate_image replaced
+    angle = np.deg2rad(angle)
+    cos_theta, sin_theta = np.cos(angle), np.sin(angle)
+    height, width = image.shape[:2]
+
+    new_width = int(np.abs(height * sin_theta) + np.abs(width * cos_theta))
+    new_height = int(np.abs(height * cos_theta) + np.abs(width * sin_theta))
+
+    new_image = np.zeros((new_height, new_width, image.shape[2]), dtype=image.dtype)
+
+    old_center = np.array([height // 2, width // 2])
+    new_center = np.array([new_height // 2, new_width // 2])
+
+    for i in range(new_height):
+        for j in range(new_width):
+            y, x = i - new_center[0], j - new_center[1]
+            old_x = int(x * cos_theta + y * sin_theta + old_center[1])
+            old_y = int(-x * sin_theta + y * cos_theta + old_center[0])
+
+            if 0 <= old_x < width and 0 <= old_y < height:
+                new_image[i, j] = image[old_y, old_x]
+
+    return new_image
+
+def sample_face_names():
+    return sorted(f for f in os.listdir(SAMPLE_FACES) if f.endswith(('.jpg', '.png', '.jpeg')))
+
+def make_synthetic_video(path, frames=300, size=(1280, 720), fps=30, seed=0, first_face=0, blurred_fraction=0.0,
+                         jitter=False):
+    # Renders bundled sample faces drifting over a noisy background, so the
+    # extraction benchmarks run offline without a real recording
+    rng = np.random.default_rng(seed)
+    width, height = size
+    names = sample_face_names()
+    faces = []
+    for name in names[first_face:first_face + 8]:
+        face = cv2.imread(os.path.join(SAMPLE_FACES, name))
+        if face is not None:
+            scale = height * 0.6 / max(face.shape[:2])
+            faces.append(cv2.resize(face, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+
+    # WebM is what browsers record and can be decoded while it is still arriving
+    fourcc = 'VP80' if path.endswith('.webm') else 'mp4v'
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    background = rng.integers(90, 140, (height, width, 3), dtype=np.uint8)
+    for index in range(frames):
+        frame = background.copy()
+        face = faces[(index // fps) % len(faces)]
+        if jitter:
+            # Small changes of distance and lighting between frames, like a moving head
+            face = cv2.resize(face, None, fx=rng.uniform(0.9, 1.1), fy=rng.uniform(0.9, 1.1))
+            face = np.clip(face.astype(np.int16) + rng.integers(-20, 21), 0, 255).astype(np.uint8)
+        face_height, face_width = face.shape[:2]
+        x = int((width - face_width) * (0.5 + 0.4 * np.sin(index / fps)))
+        y = int((height - face_height) * 0.5)
+        frame[y:y + face_height, x:x + face_width] = face
+        if rng.random() < blurred_fraction:
+            # Horizontal motion blur, as from a shaking hand
+            frame = cv2.filter2D(frame, -1, np.full((1, 25), 1 / 25))
+        writer.write(frame)
+    writer.release()
+    return path
+
+def measure(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+def benchmark_rotate(args):
+    from model import rotate_image
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (args.size, args.size, 1), dtype=np.uint8)
+
+    for angle in args.angles:
+        expected = rotate_image_loop(image, angle)
+        if not np.array_equal(expected, rotate_image(image, angle)):
+            raise SystemExit(f"rotate_image differs from the reference loop at {angle} degrees")
+
+        loop_time = measure(lambda: rotate_image_loop(image, angle), max(1, args.repeats // 100))
+        uncached_time = measure(lambda: rotate_image(image, angle, cache=False), args.repeats)
+        cached_time = measure(lambda: rotate_image(image, angle), args.repeats)
+        bilinear_time = measure(lambda: rotate_image(image, angle, mode='bilinear'), args.repeats)
+
+        print(f"Angle {angle:>6.1f}: loop {loop_time * 1e3:8.3f} ms, "
+              f"vectorized {uncached_time * 1e3:7.3f} ms, cached {cached_time * 1e3:7.3f} ms, "
+              f"bilinear {bilinear_time * 1e3:7.3f} ms, speedup {loop_time / cached_time:6.1f}x")
+
+def benchmark_augment(args):
+    from model import DataGenerator, data_augmentation
+
+    rng = np.random.default_rng(0)
+    images = rng.random((args.samples, 64, 64, 1), dtype=np.float32)
+    labels = rng.integers(0, 2, args.samples)
+
+    def legacy_epoch():
+        # Per-image random_transform, as DataGenerator did before batching
+        indices = np.arange(args.samples)
+        for step in range(args.samples // args.batch_size):
+            batch = indices[step * args.batch_size:(step + 1) * args.batch_size]
+            np.array([data_augmentation.random_transform(images[i]) for i in batch]), labels[batch]
+
+    generator = DataGenerator(images, labels, batch_size=args.batch_size, augment=True, seed=0,
+                              fan_out=args.fan_out, drop_remainder=True)
+
+    def batched_epoch():
+        for step in range(len(generator)):
+            generator[step]
+        generator.on_epoch_end()
+
+    steps = args.samples // args.batch_size
+    legacy_time = measure(legacy_epoch, args.repeats)
+    batched_time = measure(batched_epoch, args.repeats) / len(generator) * steps
+
+    print(f"Batch size {args.batch_size}, {steps} steps per epoch, fan-out {args.fan_out}")
+    print(f"Per-image random_transform: {steps / legacy_time:9.1f} steps/sec")
+    print(f"Batched augment_batch:      {steps / batched_time:9.1f} steps/sec "
+          f"({legacy_time / batched_time:.1f}x)")
+    print(f"Augmentation throughput:    {generator.augmentation_throughput():9.1f} images/sec")
+
+def benchmark_extract(args):
+    from video import split_video_into_faces
+
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = args.video or make_synthetic_video(os.path.join(directory, 'sample.mp4'), frames=args.frames)
+        for workers in args.workers:
+            start = time.perf_counter()
+            face_count = split_video_into_faces(video_path, os.path.join(directory, f'faces_{workers}'),
+                                                frame_rate=args.frame_rate, max_faces=args.max_faces,
+                                                workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>2} workers: {face_count} faces in {elapsed:.2f}s")
+
+def box_iou(a, b):
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union else 0.0
+
+def benchmark_fast(args):
+    from face_detection import FaceTracker, detect_faces
+
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = args.video or make_synthetic_video(os.path.join(directory, 'sample.mp4'),
+                                                        frames=args.frames, size=(1920, 1080))
+        tracker = FaceTracker(max_width=args.max_width, padding=args.padding)
+        cap = cv2.VideoCapture(video_path)
+        full_time = fast_time = 0.0
+        frames = full_faces = fast_faces = matched = 0
+        ious = []
+
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            start = time.perf_counter()
+            expected = detect_faces(gray, min_neighbors=15)
+            full_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            found = tracker.detect(gray)
+            fast_time += time.perf_counter() - start
+
+            frames += 1
+            full_faces += len(expected)
+            fast_faces += len(found)
+            for box in expected:
+                best = max((box_iou(box, other) for other in found), default=0.0)
+                if best >= 0.5:
+                    matched += 1
+                    ious.append(best)
+        cap.release()
+
+    print(f"{frames} frames, max width {args.max_width}, ROI padding {args.padding}")
+    print(f"Full resolution: {full_faces} faces, {full_time / frames * 1e3:7.2f} ms/frame")
+    print(f"Fast mode:       {fast_faces} faces, {fast_time / frames * 1e3:7.2f} ms/frame "
+          f"({full_time / max(fast_time, 1e-9):.1f}x), {tracker.stats()}")
+    print(f"Recall vs full resolution: {matched / max(full_faces, 1):.3f}, "
+          f"mean IoU of matches: {np.mean(ious) if ious else 0.0:.3f}")
+
+def benchmark_batching(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from batching import MicroBatcher
+    from model import create_model
+
+    model = create_model((3, 3), 2)
+    images = np.random.default_rng(0).random((args.requests, 64, 64, 1), dtype=np.float32)
+    model.predict(images[:1], verbose=0)
+
+    def timed(function):
+        def run(image):
+            start = time.perf_counter()
+            function(image)
+            return time.perf_counter() - start
+        return run
+
+    for name, function in [
+        ('predict per request', timed(lambda image: model.predict(image[np.newaxis], verbose=0))),
+        ('micro-batched', timed(lambda image: batcher.predict(model, image))),
+    ]:
+        batcher = MicroBatcher(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+        batcher.predict(model, images[0])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            latencies = np.array(list(executor.map(function, images))) * 1000
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20}: {args.requests / elapsed:7.1f} req/s, p50 {np.percentile(latencies, 50):7.2f} ms, "
+              f"p99 {np.percentile(latencies, 99):7.2f} ms")
+    print(f"Batcher stats: {batcher.stats()}")
+
+BACKEND_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+backend, path, repeats = sys.argv[1], sys.argv[2], int(sys.argv[3])
+import numpy as np
+if backend == 'tflite':
+    from tflite_backend import TFLiteModel
+    model = TFLiteModel(path)
+else:
+    from tensorflow.keras import models
+    model = models.load_model(path)
+image = np.zeros((1, 64, 64, 1), dtype=np.float32)
+model.predict(image, verbose=0)
+cold_start = time.perf_counter() - start
+start = time.perf_counter()
+for _ in range(repeats):
+    model.predict(image, verbose=0)
+latency = (time.perf_counter() - start) / repeats
+from metrics import peak_rss_mb
+print(json.dumps({'cold_start_s': cold_start, 'latency_ms': latency * 1000, 'max_rss_mb': peak_rss_mb()}))
+"""
+
+def benchmark_backends(args):
+    from model import create_model, export_tflite, save_model
+
+    with tempfile.TemporaryDirectory() as directory:
+        keras_path = args.model or os.path.join(directory, 'face_model.keras')
+        if not args.model:
+            save_model(create_model((3, 3), 2), keras_path)
+
+        from tensorflow.keras import models
+        model = models.load_model(keras_path)
+        representative = np.random.default_rng(0).random((50, 64, 64, 1), dtype=np.float32)
+        artifacts = [('keras', keras_path)]
+        for quantization in args.quantizations:
+            tflite_path = os.path.join(directory, f'face_model_{quantization}.tflite')
+            export_tflite(model, tflite_path, quantization, representative)
+            artifacts.append((f'tflite {quantization}', tflite_path))
+
+        for name, path in artifacts:
+            output = subprocess.run([sys.executable, '-c', BACKEND_PROBE, name.split()[0], path, str(args.repeats)],
+                                    capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{name:>14}: {os.path.getsize(path) / 1024:8.0f} KB, cold start {result['cold_start_s']:6.2f}s, "
+                  f"RSS {result['max_rss_mb']:7.1f} MB, {result['latency_ms']:6.2f} ms/image")
+
+TRAINING_PROBE = """
+import json, sys, time
+import numpy as np
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+from model import DataGenerator, EpochTimer, configure_training, create_model, fetch_image_data
+
+config, user_directory, unknown_directory, epochs = json.loads(sys.argv[1]), sys.argv[2], sys.argv[3], int(sys.argv[4])
+configure_training(config['precision'], config['threads'], config['threads'])
+
+images, labels = fetch_image_data(user_directory, unknown_directory)
+labels = (labels == labels[0]).astype(np.int64)
+train_images, val_images, train_labels, val_labels = train_test_split(
+    images.reshape(-1, 64, 64, 1), labels, test_size=0.2, stratify=labels, random_state=0)
+train_gen = DataGenerator(train_images, train_labels, batch_size=config['batch_size'], augment=True, seed=0,
+                          drop_remainder=True)
+val_gen = DataGenerator(val_images, val_labels, batch_size=config['batch_size'])
+
+tf.keras.utils.set_random_seed(0)
+model = create_model((3, 3), 2)
+model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'],
+              jit_compile=config['jit_compile'])
+epoch_timer = EpochTimer()
+history = model.fit(train_gen, epochs=epochs, validation_data=val_gen, callbacks=[epoch_timer], verbose=0)
+print(json.dumps({'first_epoch_s': epoch_timer.times[0], 'epoch_s': float(np.mean(epoch_timer.times[1:])),
+                  'val_accuracy': history.history['val_accuracy'][-1]}))
+"""
+
+def default_user_directory():
+    base_directory = os.path.dirname(SAMPLE_FACES)
+    for name in sorted(os.listdir(base_directory)):
+        path = os.path.join(base_directory, name)
+        if name not in ('unknown', 'prototypes') and not name.startswith('.') and os.path.isdir(path):
+            return path
+    return None
+
+def benchmark_training(args):
+    user_directory = args.user_directory or default_user_directory()
+    if user_directory is None:
+        raise SystemExit("No enrolled user found, pass --user-directory")
+
+    # Every option is varied on its own against the float32 baseline
+    baseline = {'precision': 'float32', 'jit_compile': False, 'batch_size': 32, 'threads': 0}
+    configs = [baseline]
+    configs += [dict(baseline, precision=precision) for precision in args.precisions if precision != 'float32']
+    configs += [dict(baseline, jit_compile=True)]
+    configs += [dict(baseline, batch_size=batch_size) for batch_size in args.batch_sizes if batch_size != 32]
+    configs += [dict(baseline, threads=threads) for threads in args.threads if threads != 0]
+
+    print(f"Training on {user_directory} against {SAMPLE_FACES}, {args.epochs} epochs per configuration")
+    print(f"{'precision':>15} {'xla':>5} {'batch':>6} {'threads':>8} {'1st epoch':>10} {'epoch':>8} {'val acc':>8}")
+    for config in configs:
+        row = f"{config['precision']:>15} {str(config['jit_compile']):>5} {config['batch_size']:>6} {config['threads']:>8}"
+        try:
+            completed = subprocess.run([sys.executable, '-c', TRAINING_PROBE, json.dumps(config), user_directory,
+                                        SAMPLE_FACES, str(args.epochs)], capture_output=True, text=True,
+                                       timeout=args.timeout, cwd=os.path.dirname(os.path.abspath(__file__)))
+        except subprocess.TimeoutExpired:
+            # float16 is emulated on most CPUs and can be dramatically slower
+            print(f"{row} timed out after {args.timeout}s", flush=True)
+            continue
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'
+            print(f"{row} {error}", flush=True)
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"{row} {result['first_epoch_s']:9.1f}s {result['epoch_s']:7.1f}s {result['val_accuracy']:8.3f}",
+              flush=True)
+
+UPLOAD_PROBE = """
+import json, os, sys, tempfile, threading, time
+from video import UploadSpool, iter_face_crops
+
+mode, video_path, bandwidth, max_faces = sys.argv[1], sys.argv[2], float(sys.argv[3]) * 1024 * 1024, int(sys.argv[4])
+
+def upload(write):
+    # Replays the video at the given bandwidth in 64 KB chunks, like a request body arriving
+    with open(video_path, 'rb') as f:
+        start, sent = time.perf_counter(), 0
+        while True:
+            data = f.read(64 * 1024)
+            if not data or not write(data):
+                break
+            sent += len(data)
+            delay = sent / bandwidth - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+start = time.perf_counter()
+first_face = None
+faces = 0
+if mode == 'staged':
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(video_path)[1], dir='.') as f:
+        upload(lambda data: f.write(data) or True)
+        f.flush()
+        uploaded = time.perf_counter() - start
+        for crop in iter_face_crops(f.name, 150, max_faces):
+            first_face = first_face or time.perf_counter() - start
+            faces += 1
+        spooled = os.path.getsize(f.name)
+else:
+    spool = UploadSpool(directory='.', expected_size=os.path.getsize(video_path))
+    uploaded = None
+    def feed():
+        # The server keeps draining the body after extraction stopped, the spool drops the data
+        global uploaded
+        upload(lambda data: spool.append(data) or True)
+        uploaded = time.perf_counter() - start
+        spool.finish()
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    for crop in iter_face_crops(spool, 150, max_faces):
+        first_face = first_face or time.perf_counter() - start
+        faces += 1
+    faces_done = time.perf_counter() - start
+    feeder.join()
+    spooled = spool.size
+    spool.close()
+ready = time.perf_counter() - start if mode == 'staged' else max(faces_done, uploaded)
+
+from metrics import peak_rss_mb
+print(json.dumps({'faces': faces, 'upload_s': uploaded, 'first_face_s': first_face or 0.0, 'ready_s': ready,
+                  'spooled_mb': spooled / 1024 / 1024, 'max_rss_mb': peak_rss_mb()}))
+"""
+
+def benchmark_upload(args):
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = args.video or make_synthetic_video(os.path.join(directory, 'sample.webm'), frames=args.frames)
+        print(f"{os.path.basename(video_path)}: {os.path.getsize(video_path) / 1024 / 1024:.1f} MB "
+              f"uploaded at {args.bandwidth} MB/s, stopping at {args.max_faces} faces")
+        for mode in ['staged', 'streaming']:
+            output = subprocess.run([sys.executable, '-c', UPLOAD_PROBE, mode, video_path, str(args.bandwidth),
+                                     str(args.max_faces)], capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>9}: {result['faces']} faces, first face after {result['first_face_s']:5.2f}s, "
+                  f"faces ready {result['ready_s']:5.2f}s after {result['upload_s']:5.2f}s upload, "
+                  f"{result['spooled_mb']:5.1f} MB spooled, RSS {result['max_rss_mb']:6.1f} MB")
+
+STARTUP_PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+from metrics import peak_rss_mb
+print(json.dumps({'import_s': seconds, 'max_rss_mb': peak_rss_mb(), 'tensorflow': 'tensorflow' in sys.modules,
+                  'sklearn': 'sklearn' in sys.modules}))
+sys.stdout.flush()
+import os
+os._exit(0)
+"""
+
+def benchmark_startup(args):
+    # Each import runs in a fresh interpreter in an empty directory, so the service's
+    # job database and upload folders are not touched
+    source_directory = os.path.dirname(os.path.abspath(__file__))
+    cases = [
+        ('main', {}),
+        ('main', {'PRELOAD': '1'}),
+        ('showcase', {}),
+        ('model', {}),
+    ]
+    print(f"{'module':>10} {'preload':>8} {'import':>8} {'RSS':>9}  tensorflow  sklearn")
+    for module, environment in cases:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PYTHONPATH=source_directory, **environment)
+            results = []
+            for _ in range(args.repeats):
+                output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, module], capture_output=True, text=True,
+                                        check=True, cwd=directory, env=env).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+        result = min(results, key=lambda result: result['import_s'])
+        print(f"{module:>10} {str(bool(environment)):>8} {result['import_s']:7.2f}s {result['max_rss_mb']:7.1f}MB  "
+              f"{str(result['tensorflow']):>10}  {str(result['sklearn']):>7}")
+
+SUITE_USER = 'benchmark'
+
+VERIFICATION_PROBE = """
+import json, statistics, sys, time
+start = time.perf_counter()
+import showcase
+user_id, image_path, repeats = sys.argv[1], sys.argv[2], int(sys.argv[3])
+result = showcase.main(user_id, image_path)
+cold = time.perf_counter() - start
+if 'error' in result:
+    raise SystemExit(result['error'])
+times = []
+for _ in range(repeats):
+    start = time.perf_counter()
+    showcase.main(user_id, image_path)
+    times.append(time.perf_counter() - start)
+print(json.dumps({'cold_s': cold, 'warm_s': statistics.median(times)}))
+"""
+
+def benchmark_selection(args):
+    # Trains on every extracted face and on the selected ones, and tests both models
+    # on faces from later in the video and on held-out unknown faces
+    import tensorflow as tf
+    from sklearn.model_selection import train_test_split
+    from dataset import load_directory, preprocess_face
+    from model import DataGenerator, create_model, train_and_evaluate_model
+    from quality import select_faces
+    from video import iter_face_crops
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = sample_face_names()
+        video_path = make_synthetic_video(os.path.join(directory, 'sample.mp4'), frames=args.frames,
+                                          first_face=len(names) - 8, blurred_fraction=args.blurred_fraction,
+                                          jitter=True)
+        crops = list(iter_face_crops(video_path, max_faces=args.frames))
+        unknown_directory = os.path.join(directory, 'unknown')
+        os.makedirs(unknown_directory)
+        for name in names[:-8]:
+            shutil.copy(os.path.join(SAMPLE_FACES, name), unknown_directory)
+        unknown = load_directory(unknown_directory)
+
+    def batch(faces):
+        return np.array([preprocess_face(face) for face in faces], dtype=np.float32)
+
+    candidates = crops[:args.max_faces]
+    start = time.perf_counter()
+    selected = select_faces(candidates, args.keep)
+    selection_time = time.perf_counter() - start
+    unknown_train, unknown_test = train_test_split(unknown, test_size=0.2, random_state=0)
+    test_images = np.concatenate([batch(crops[args.max_faces:]), unknown_test])
+    test_labels = np.array([0] * (len(crops) - args.max_faces) + [1] * len(unknown_test))
+    print(f"Testing on {len(crops) - args.max_faces} later user faces and {len(unknown_test)} unknown faces")
+
+    print(f"{'faces':>9} {'user':>5} {'select':>7} {'epochs':>7} {'epoch':>7} {'training':>9} {'test acc':>9}")
+    for name, faces, seconds in [('all', candidates, 0.0), ('selected', selected, selection_time)]:
+        images = np.concatenate([batch(faces), unknown_train])
+        labels = np.array([0] * len(faces) + [1] * len(unknown_train))
+        train_images, val_images, train_labels, val_labels = train_test_split(
+            images, labels, test_size=0.2, stratify=labels, random_state=0)
+
+        tf.keras.utils.set_random_seed(0)
+        model = create_model((3, 3), 2)
+        start = time.perf_counter()
+        history, _ = train_and_evaluate_model(model, DataGenerator(train_images, train_labels, augment=True, seed=0,
+                                                                   drop_remainder=True),
+                                              DataGenerator(val_images, val_labels), val_images, val_labels,
+                                              epochs=args.epochs)
+        training_time = time.perf_counter() - start
+        _, accuracy = model.evaluate(test_images, test_labels, verbose=0)
+        epochs = len(history.history['loss'])
+        print(f"{name:>9} {len(faces):>5} {seconds:6.2f}s {epochs:>7} {training_time / epochs:6.1f}s "
+              f"{training_time:8.1f}s {accuracy:9.3f}", flush=True)
+
+def median_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def environment():
+    import tensorflow as tf
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'opencv': cv2.__version__, 'tensorflow': tf.__version__}
+
+def run_suite(args):
+    # Every stage of enrolment and verification on the same synthetic user, in a
+    # scratch faces/ folder so nothing enrolled on this machine is read or changed
+    from video import split_video_into_faces
+
+    metrics = {}
+
+    def record(name, value, unit, better):
+        metrics[name] = {'value': value, 'unit': unit, 'better': better}
+        print(f"{name:>26}: {value:10.3f} {unit}", flush=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        faces_directory = os.path.join(directory, 'faces')
+        user_directory = os.path.join(faces_directory, SUITE_USER)
+        unknown_directory = os.path.join(faces_directory, 'unknown')
+
+        # The synthetic user is drawn from the last sample faces, the rest stay unknown
+        names = sample_face_names()
+        os.makedirs(unknown_directory)
+        for name in names[:-8]:
+            shutil.copy(os.path.join(SAMPLE_FACES, name), unknown_directory)
+        video_path = args.video or make_synthetic_video(os.path.join(directory, 'sample.mp4'), frames=args.frames,
+                                                        first_face=len(names) - 8)
+        capture = cv2.VideoCapture(video_path)
+        capture.read()
+        _, probe = capture.read()
+        capture.release()
+        probe_path = os.path.join(directory, 'probe.jpg')
+        cv2.imwrite(probe_path, probe)
+
+        face_counts = []
+
+        def extract():
+            shutil.rmtree(user_directory, ignore_errors=True)
+            face_counts.append(split_video_into_faces(video_path, user_directory, frame_rate=args.frame_rate,
+                                                      max_faces=args.max_faces))
+
+        seconds = median_time(extract, args.repeats)
+        record('extraction_faces_per_s', face_counts[0] / seconds, 'faces/s', 'higher')
+
+        import tensorflow as tf
+        from model import DataGenerator, EpochTimer, create_model, fetch_image_data, save_model
+
+        cache_directory = os.path.join(faces_directory, '.cache')
+        record('dataset_load_cold_s', median_time(lambda: fetch_image_data(user_directory, unknown_directory),
+                                                  args.repeats), 's', 'lower')
+        fetch_image_data(user_directory, unknown_directory, cache_directory)
+        # A few milliseconds, so it takes more samples to be stable
+        record('dataset_load_cached_ms', median_time(
+            lambda: fetch_image_data(user_directory, unknown_directory, cache_directory), args.repeats * 10) * 1000,
+               'ms', 'lower')
+
+        images, labels = fetch_image_data(user_directory, unknown_directory, cache_directory)
+        images = images.reshape(-1, 64, 64, 1)
+        labels = (labels == SUITE_USER).astype(np.int64)
+        generator = DataGenerator(images, labels, batch_size=args.batch_size, augment=True, seed=0,
+                                  drop_remainder=True)
+
+        def augment_epoch():
+            for step in range(len(generator)):
+                generator[step]
+            generator.on_epoch_end()
+
+        record('augmentation_images_per_s', len(generator) * args.batch_size / median_time(augment_epoch, args.repeats),
+               'images/s', 'higher')
+
+        tf.keras.utils.set_random_seed(0)
+        model = create_model((3, 3), 2)
+        model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        epoch_times = EpochTimer()
+        model.fit(DataGenerator(images, labels, batch_size=args.batch_size, augment=True, seed=0,
+                                drop_remainder=True),
+                  epochs=args.epochs + 1, callbacks=[epoch_times], verbose=0)
+        # The first epoch traces the training step, the others are the steady state
+        record('training_first_epoch_s', epoch_times.times[0], 's', 'lower')
+        record('training_epoch_s', statistics.median(epoch_times.times[1:]), 's', 'lower')
+        save_model(model, os.path.join(faces_directory, f'{SUITE_USER}_face_model.keras'))
+
+        # Cold verification is a fresh process, including the TensorFlow import and model load
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        completed = subprocess.run([sys.executable, '-c', VERIFICATION_PROBE, SUITE_USER, probe_path,
+                                    str(args.verifications)], capture_output=True, text=True, cwd=directory, env=env)
+        if completed.returncode != 0:
+            raise SystemExit(f"Verification failed: {completed.stderr.strip().splitlines()[-1]}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        record('verification_cold_s', result['cold_s'], 's', 'lower')
+        record('verification_warm_ms', result['warm_s'] * 1000, 'ms', 'lower')
+
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'environment': environment(),
+               'config': {key: value for key, value in vars(args).items() if key not in ('function', 'output', 'baseline')},
+               'metrics': metrics}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, args.tolerance):
+            sys.exit(1)
+
+def compare_results(results, baseline, tolerance):
+    # Returns the metrics that got worse than the baseline by more than the tolerance
+    for key in ('environment', 'config'):
+        differences = sorted(name for name in set(results[key]) | set(baseline[key])
+                             if results[key].get(name) != baseline[key].get(name))
+        if differences:
+            print(f"Note: {key} differs from the baseline in {', '.join(differences)}")
+
+    regressions = []
+    print(f"\n{'metric':>26} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, metric in results['metrics'].items():
+        if name not in baseline['metrics']:
+            continue
+        before, after = baseline['metrics'][name]['value'], metric['value']
+        change = (after - before) / before if before else 0.0
+        worse = change > tolerance if metric['better'] == 'lower' else change < -tolerance
+        if worse:
+            regressions.append(name)
+        print(f"{name:>26} {before:10.3f} {after:10.3f} {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {tolerance:.0%}: {', '.join(regressions)}")
+    else:
+        print(f"No regressions beyond {tolerance:.0%}")
+    return regressions
+
+def benchmark_compare(args):
+    with open(args.results) as f:
+        results = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if compare_results(results, baseline, args.tolerance):
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the face pipeline")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rotate_parser = subparsers.add_parser('rotate', help="rotate_image against the per-pixel loop")
+    rotate_parser.add_argument('--size', type=int, default=64)
+    rotate_parser.add_argument('--angles', type=float, nargs='+', default=[10, -20, 45, 90])
+    rotate_parser.add_argument('--repeats', type=int, default=200)
+    rotate_parser.set_defaults(function=benchmark_rotate)
+
+    augment_parser = subparsers.add_parser('augment', help="DataGenerator augmentation throughput")
+    augment_parser.add_argument('--samples', type=int, default=1024)
+    augment_parser.add_argument('--batch-size', type=int, default=32)
+    augment_parser.add_argument('--repeats', type=int, default=3)
+    augment_parser.add_argument('--fan-out', type=int, default=1)
+    augment_parser.set_defaults(function=benchmark_augment)
+
+    extract_parser = subparsers.add_parser('extract', help="Video face extraction throughput")
+    extract_parser.add_argument('--video', help="Video to use instead of a synthetic one")
+    extract_parser.add_argument('--frames', type=int, default=300)
+    extract_parser.add_argument('--frame-rate', type=int, default=150)
+    extract_parser.add_argument('--max-faces', type=int, default=250)
+    extract_parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    extract_parser.set_defaults(function=benchmark_extract)
+
+    fast_parser = subparsers.add_parser('fast', help="Fast detection mode against full-resolution detection")
+    fast_parser.add_argument('--video', help="Video to use instead of a synthetic 1080p one")
+    fast_parser.add_argument('--frames', type=int, default=120)
+    fast_parser.add_argument('--max-width', type=int, default=640)
+    fast_parser.add_argument('--padding', type=float, default=0.5)
+    fast_parser.set_defaults(function=benchmark_fast)
+
+    batching_parser = subparsers.add_parser('batching', help="Concurrent verification with and without micro-batching")
+    batching_parser.add_argument('--requests', type=int, default=400)
+    batching_parser.add_argument('--concurrency', type=int, default=16)
+    batching_parser.add_argument('--max-batch-size', type=int, default=16)
+    batching_parser.add_argument('--max-wait-ms', type=float, default=5)
+    batching_parser.set_defaults(function=benchmark_batching)
+
+    backends_parser = subparsers.add_parser('backends', help="Keras against TFLite verification backends")
+    backends_parser.add_argument('--model', help="Trained .keras model to use instead of an untrained one")
+    backends_parser.add_argument('--quantizations', nargs='+', default=['float16', 'int8'])
+    backends_parser.add_argument('--repeats', type=int, default=100)
+    backends_parser.set_defaults(function=benchmark_backends)
+
+    upload_parser = subparsers.add_parser('upload', help="Staged against streaming video upload processing")
+    upload_parser.add_argument('--video', help="Video to use instead of a synthetic WebM one")
+    upload_parser.add_argument('--frames', type=int, default=900)
+    upload_parser.add_argument('--bandwidth', type=float, default=4.0, help="Upload speed in MB/s")
+    upload_parser.add_argument('--max-faces', type=int, default=250)
+    upload_parser.set_defaults(function=benchmark_upload)
+
+    startup_parser = subparsers.add_parser('startup', help="Import time and memory of the service modules")
+    startup_parser.add_argument('--repeats', type=int, default=3)
+    startup_parser.set_defaults(function=benchmark_startup)
+
+    selection_parser = subparsers.add_parser('selection', help="Training on all extracted faces against selected ones")
+    selection_parser.add_argument('--frames', type=int, default=450)
+    selection_parser.add_argument('--max-faces', type=int, default=250)
+    selection_parser.add_argument('--keep', type=int, default=120)
+    selection_parser.add_argument('--blurred-fraction', type=float, default=0.2)
+    selection_parser.add_argument('--epochs', type=int, default=20)
+    selection_parser.set_defaults(function=benchmark_selection)
+
+    suite_parser = subparsers.add_parser('suite', help="Every pipeline stage, as JSON and against a baseline")
+    suite_parser.add_argument('--video', help="Video to use instead of a synthetic one")
+    suite_parser.add_argument('--frames', type=int, default=150)
+    suite_parser.add_argument('--frame-rate', type=int, default=150)
+    suite_parser.add_argument('--max-faces', type=int, default=250)
+    suite_parser.add_argument('--batch-size', type=int, default=32)
+    suite_parser.add_argument('--epochs', type=int, default=3, help="Epochs timed after the first one")
+    suite_parser.add_argument('--repeats', type=int, default=3)
+    suite_parser.add_argument('--verifications', type=int, default=20)
+    suite_parser.add_argument('--output', help="JSON file to write the results to")
+    suite_parser.add_argument('--baseline', help="Earlier results to compare against, exits with 1 on a regression")
+    suite_parser.add_argument('--tolerance', type=float, default=0.15, help="Relative slowdown tolerated")
+    suite_parser.set_defaults(function=run_suite)
+
+    compare_parser = subparsers.add_parser('compare', help="Compare saved suite results against a baseline")
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--tolerance', type=float, default=0.15)
+    compare_parser.set_defaults(function=benchmark_compare)
+
+    training_parser = subparsers.add_parser('training', help="Epoch time and accuracy of the training options")
+    training_parser.add_argument('--user-directory', help="Faces of the user to train on, defaults to the first one")
+    training_parser.add_argument('--epochs', type=int, default=4)
+    training_parser.add_argument('--precisions', nargs='+', default=['float32', 'mixed_bfloat16', 'mixed_float16'])
+    training_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 64, 128])
+    training_parser.add_argument('--threads', type=int, nargs='+', default=[0],
+                                 help="Intra- and inter-op thread counts to try, 0 lets TensorFlow pick")
+    training_parser.add_argument('--timeout', type=int, default=600, help="Seconds allowed per configuration")
+    training_parser.set_defaults(function=benchmark_training)
+
+    args = parser.parse_args()
+    args.function(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from storage import atomic_write
+import metrics
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+IMAGE_SIZE = (64, 64)
+CACHE_VERSION = 1
+
+# One lock per cache file so concurrent trainings do not rebuild the same cache twice
+_cache_locks = {}
+_cache_locks_guard = threading.Lock()
+
+def preprocess_face(image):
+    # BGR or grayscale crop -> normalized (64, 64, 1) float32 tensor. Nearest-exact
+    # resizing samples the same pixels as keras load_img did.
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    elif image.ndim == 3:
+        image = image[:, :, 0]
+    image = cv2.resize(image, IMAGE_SIZE, interpolation=cv2.INTER_NEAREST_EXACT)
+    return (image.astype(np.float32) / 255.0)[:, :, np.newaxis]
+
+def _decode_file(path):
+    # Reads the file once for both the content hash and the decode. cv2 releases
+    # the GIL while decoding, so a thread pool decodes in parallel.
+    data = np.fromfile(path, dtype=np.uint8)
+    digest = hashlib.sha1(data).hexdigest()
+    image = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Could not decode image {path}")
+    return preprocess_face(image), digest
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _cache_paths(directory, cache_directory):
+    directory = os.path.abspath(directory)
+    key = f"{os.path.basename(directory)}-{hashlib.sha1(directory.encode()).hexdigest()[:8]}"
+    return os.path.join(cache_directory, f"{key}.npy"), os.path.join(cache_directory, f"{key}.json")
+
+def _cache_lock(path):
+    with _cache_locks_guard:
+        return _cache_locks.setdefault(path, threading.Lock())
+
+def _read_cache(array_path, manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        images = np.load(array_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return [], None
+
+    entries = manifest.get('files', [])
+    if manifest.get('version') != CACHE_VERSION or images.shape != (len(entries), *IMAGE_SIZE, 1):
+        return [], None
+    return entries, images
+
+def _write_cache(array_path, manifest_path, images, entries):
+    os.makedirs(os.path.dirname(array_path), exist_ok=True)
+
+    def write_manifest(path):
+        with open(path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'files': entries}, f)
+
+    # Array first, manifest last: a reader only trusts an array whose row count matches the manifest
+    atomic_write(array_path, lambda path: np.save(path, images))
+    atomic_write(manifest_path, write_manifest)
+
+def list_image_files(directory):
+    return sorted(f for f in os.listdir(directory) if f.endswith(IMAGE_EXTENSIONS))
+
+@metrics.timer('dataset_load')
+def load_directory(directory, cache_directory=None, workers=None):
+    # Returns the preprocessed (N, 64, 64, 1) tensors of every image in directory.
+    # With a cache directory, unchanged files are served from a memory-mapped .npy
+    # and only new or modified files are decoded again.
+    file_names = list_image_files(directory)
+    workers = workers or min(8, os.cpu_count() or 1)
+
+    if cache_directory is None:
+        paths = [os.path.join(directory, name) for name in file_names]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            decoded = list(executor.map(_decode_file, paths))
+        return np.array([image for image, _ in decoded], dtype=np.float32).reshape(-1, *IMAGE_SIZE, 1)
+
+    array_path, manifest_path = _cache_paths(directory, cache_directory)
+
+    with _cache_lock(array_path):
+        cached_entries, cached_images = _read_cache(array_path, manifest_path)
+        cached_rows = {entry['name']: (row, entry) for row, entry in enumerate(cached_entries)}
+
+        entries = []
+        rows = []
+        stale = []
+        for name in file_names:
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            entry = {'name': name, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+            row, cached = cached_rows.get(name, (None, None))
+
+            if cached is not None and (cached['mtime_ns'], cached['size']) == (entry['mtime_ns'], entry['size']):
+                entry['sha1'] = cached['sha1']
+            elif cached is not None and cached['size'] == entry['size'] and cached['sha1'] == _file_digest(path):
+                # Touched but unchanged
+                entry['sha1'] = cached['sha1']
+            else:
+                row = None
+                stale.append(len(entries))
+
+            entries.append(entry)
+            rows.append(row)
+
+        if (cached_images is not None and not stale and len(entries) == len(cached_entries)
+                and rows == list(range(len(rows)))):
+            return cached_images
+
+        images = np.empty((len(entries), *IMAGE_SIZE, 1), dtype=np.float32)
+        for index, row in enumerate(rows):
+            if row is not None:
+                images[index] = cached_images[row]
+        # The reused rows are copied, the memory map must be closed before its file is
+        # replaced (Windows refuses to replace a mapped file)
+        del cached_images
+
+        paths = [os.path.join(directory, entries[index]['name']) for index in stale]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, (image, digest) in zip(stale, executor.map(_decode_file, paths)):
+                images[index] = image
+                entries[index]['sha1'] = digest
+
+        print(f"Decoded {len(stale)} of {len(entries)} images in {directory}")
+        _write_cache(array_path, manifest_path, images, entries)
+        return images
@@ -0,0 +1,173 @@
+import os
+import sys
+import threading
+import numpy as np
+from sklearn.model_selection import train_test_split
+from tensorflow.keras import layers, models
+from dataset import list_image_files, load_directory
+from model import DataGenerator, add_backbone, save_model, train_and_evaluate_model
+from model_registry import registry
+from storage import atomic_write
+import metrics
+
+# Alternative verification engine: one face embedding network shared by every user
+# and a few embedding prototypes per user. Enrolment is a forward pass over the
+# extracted faces and verification a cosine similarity lookup, nothing is trained
+# per user.
+
+BASE_DIRECTORY = 'faces'
+EMBEDDING_MODEL_PATH = os.path.join(BASE_DIRECTORY, 'embedding_model.keras')
+PROTOTYPE_DIRECTORY = os.path.join(BASE_DIRECTORY, 'prototypes')
+EMBEDDING_SIZE = 64
+NUM_PROTOTYPES = 5
+# The unknown set holds many different people, it needs more prototypes to be covered
+NUM_UNKNOWN_PROTOTYPES = 20
+
+def create_embedding_model(kernel_size=(3, 3), embedding_size=EMBEDDING_SIZE):
+    model = models.Sequential()
+
+    add_backbone(model, kernel_size)
+    # Like the classifier's softmax, the output stays in float32 under mixed precision,
+    # float16 embeddings lose too much precision for the distance thresholds
+    model.add(layers.Dense(embedding_size, dtype='float32'))
+    model.add(layers.UnitNormalization(dtype='float32'))
+
+    return model
+
+def list_enrolled_users(base_directory=BASE_DIRECTORY):
+    return sorted(name for name in os.listdir(base_directory)
+                  if name != 'unknown' and not name.startswith('.')
+                  and os.path.isdir(os.path.join(base_directory, name))
+                  and list_image_files(os.path.join(base_directory, name)))
+
+def train_embedding_model(base_directory=BASE_DIRECTORY, model_path=EMBEDDING_MODEL_PATH):
+    # Trains the embedding as an identity classifier over the enrolled users plus the
+    # shared unknown set, then keeps only the normalized embedding part
+    cache_directory = os.path.join(base_directory, '.cache')
+    identities = list_enrolled_users(base_directory) + ['unknown']
+
+    images = []
+    labels = []
+    for label, identity in enumerate(identities):
+        identity_images = load_directory(os.path.join(base_directory, identity), cache_directory)
+        images.append(identity_images)
+        labels.extend([label] * len(identity_images))
+    images = np.concatenate(images)
+    labels = np.array(labels)
+    print(f"Training embedding model on {len(images)} faces of {len(identities)} identities")
+
+    train_images, val_images, train_labels, val_labels = train_test_split(
+        images, labels, test_size=0.2, stratify=labels)
+
+    embedding_model = create_embedding_model()
+    classifier = models.Sequential([embedding_model, layers.Dense(len(identities), activation='softmax')])
+
+    train_gen = DataGenerator(train_images, train_labels, augment=True, drop_remainder=True)
+    val_gen = DataGenerator(val_images, val_labels, augment=False)
+    _, test_acc = train_and_evaluate_model(classifier, train_gen, val_gen, val_images, val_labels)
+    print(f"Embedding model identity accuracy: {test_acc:.4f}")
+
+    save_model(embedding_model, model_path)
+
+    # Prototypes computed with the previous embedding model are stale
+    for user_id in identities[:-1]:
+        enroll(user_id, load_directory(os.path.join(base_directory, user_id), cache_directory))
+    enroll('unknown', images[labels == len(identities) - 1], NUM_UNKNOWN_PROTOTYPES)
+    return embedding_model
+
+def compute_prototypes(embeddings, count=NUM_PROTOTYPES, iterations=10):
+    # Spherical k-means, a few centers cover the poses and lighting of the enrolment video
+    count = min(count, len(embeddings))
+    rng = np.random.default_rng(0)
+    centers = embeddings[rng.choice(len(embeddings), count, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(embeddings @ centers.T, axis=1)
+        for index in range(count):
+            members = embeddings[assignment == index]
+            if len(members):
+                centers[index] = members.mean(axis=0)
+        centers /= np.maximum(np.linalg.norm(centers, axis=1, keepdims=True), 1e-12)
+
+    return centers.astype(np.float32)
+
+class PrototypeIndex:
+    # Per-user prototype store, one .npy per user, cached in memory until the file changes
+    def __init__(self, directory=PROTOTYPE_DIRECTORY):
+        self.directory = directory
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def _path(self, user_id):
+        if os.path.basename(user_id) != user_id or user_id.startswith('.'):
+            raise ValueError(f"Invalid user id {user_id}")
+        return os.path.join(self.directory, f"{user_id}.npy")
+
+    def save(self, user_id, prototypes):
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(self._path(user_id), lambda path: np.save(path, prototypes))
+
+    def load(self, user_id):
+        path = self._path(user_id)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            entry = self.cache.get(user_id)
+            if entry is not None and entry[0] == mtime_ns:
+                return entry[1]
+
+        prototypes = np.load(path)
+        with self.lock:
+            self.cache[user_id] = (mtime_ns, prototypes)
+        return prototypes
+
+    def __contains__(self, user_id):
+        return os.path.exists(self._path(user_id))
+
+index = PrototypeIndex()
+
+def is_available():
+    return os.path.exists(EMBEDDING_MODEL_PATH)
+
+@metrics.timer('embed')
+def embed(faces, batcher=None):
+    model = registry.get(EMBEDDING_MODEL_PATH)
+    faces = np.asarray(faces, dtype=np.float32).reshape(-1, 64, 64, 1)
+    if batcher is not None:
+        return np.stack([batcher.predict(model, face) for face in faces])
+    return model.predict(faces, verbose=0)
+
+def enroll(user_id, faces, count=NUM_PROTOTYPES):
+    prototypes = compute_prototypes(embed(faces), count)
+    index.save(user_id, prototypes)
+    print(f"Enrolled user {user_id} with {len(prototypes)} prototypes from {len(faces)} faces")
+    return prototypes
+
+def verify(user_id, face, threshold=0.9, batcher=None):
+    prototypes = index.load(user_id)
+    if prototypes is None:
+        return {"error": f"User {user_id} is not enrolled.", "success": False}
+
+    face_embedding = embed(face, batcher)[0]
+    similarity = float(np.max(prototypes @ face_embedding))
+
+    # The probe also has to be closer to the user than to anyone in the unknown set
+    unknown_prototypes = index.load('unknown')
+    unknown_similarity = float(np.max(unknown_prototypes @ face_embedding)) if unknown_prototypes is not None else -1.0
+
+    if similarity < threshold or similarity <= unknown_similarity:
+        return {"message": "Face is not similar enough to the enrolled user.", "success": False, "confidence": similarity}
+    return {"message": f"Image matches the class {user_id}.", "success": True, "confidence": similarity}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('train', 'enroll'):
+        print("Usage: python embedding.py train | python embedding.py enroll <user_id>")
+        sys.exit(1)
+    if sys.argv[1] == 'train':
+        train_embedding_model()
+    else:
+        user_id = sys.argv[2]
+        enroll(user_id, load_directory(os.path.join(BASE_DIRECTORY, user_id), os.path.join(BASE_DIRECTORY, '.cache')))
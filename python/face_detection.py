@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import metrics
+
+CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+_cascade_xml = None
+_cascade_lock = threading.Lock()
+_local = threading.local()
+_executor = None
+
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "images": 0, "faces": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+def _load_cascade_xml():
+    # The cascade file is read from disk once per process
+    global _cascade_xml
+    with _cascade_lock:
+        if _cascade_xml is None:
+            with open(CASCADE_PATH) as f:
+                _cascade_xml = f.read()
+        return _cascade_xml
+
+def get_detector():
+    # CascadeClassifier is not thread-safe, so every thread gets its own instance
+    # built from the in-memory XML
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        with metrics.timer('cascade_load'):
+            storage = cv2.FileStorage(_load_cascade_xml(), cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+            detector = cv2.CascadeClassifier()
+            if not detector.read(storage.getFirstTopLevelNode()):
+                raise RuntimeError(f"Could not load face cascade {CASCADE_PATH}")
+        _local.detector = detector
+    return detector
+
+def to_gray(image):
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+def _record(images, faces, seconds):
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["images"] += images
+        _stats["faces"] += faces
+        _stats["seconds"] += seconds
+        _stats["max_seconds"] = max(_stats["max_seconds"], seconds)
+
+def detect_faces(image, scale_factor=1.1, min_neighbors=10, min_size=(64, 64)):
+    # Returns an (N, 4) array of (x, y, w, h) boxes for a BGR or grayscale image
+    start = time.perf_counter()
+    faces = get_detector().detectMultiScale(
+        to_gray(image),
+        scaleFactor=scale_factor,  # How much the image size is reduced at each image scale
+        minNeighbors=min_neighbors,  # How many neighbors each candidate rectangle should have to retain it
+        minSize=min_size,  # Minimum possible object size
+        flags=cv2.CASCADE_SCALE_IMAGE
+    )
+    faces = np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+    seconds = time.perf_counter() - start
+    _record(1, len(faces), seconds)
+    metrics.observe('detection', seconds)
+    return faces
+
+def get_executor():
+    # Long-lived detection threads. Each keeps its own detector, so the cascade is
+    # parsed once per thread for the life of the process, not once per video.
+    global _executor
+    with _cascade_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='detect')
+        return _executor
+
+def detection_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["mean_ms"] = stats["seconds"] / stats["images"] * 1000 if stats["images"] else 0.0
+    stats["max_ms"] = stats.pop("max_seconds") * 1000
+    return stats
+
+class FaceTracker:
+    # Fast detection mode for consecutive video frames. Detection runs on a copy
+    # downscaled to max_width and the boxes are mapped back to full resolution.
+    # After a hit only a padded region around the last face is searched, a miss
+    # there falls back to a full-frame rescan. Frames must arrive in order.
+    def __init__(self, max_width=640, padding=0.5, min_neighbors=15, min_size=(64, 64)):
+        self.max_width = max_width
+        self.padding = padding
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.last_box = None
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.roi_misses = 0
+
+    def _detect_scaled(self, gray, scale, offset_x=0, offset_y=0):
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_size = (max(1, round(self.min_size[0] * scale)), max(1, round(self.min_size[1] * scale)))
+        faces = detect_faces(gray, min_neighbors=self.min_neighbors, min_size=min_size)
+        faces = np.round(faces / scale).astype(np.int32)
+        faces[:, 0] += offset_x
+        faces[:, 1] += offset_y
+        return faces
+
+    def _remember(self, faces):
+        # Track the largest face, that is the one the user is holding up to the camera
+        self.last_box = faces[np.argmax(faces[:, 2] * faces[:, 3])] if len(faces) else None
+
+    def detect(self, image):
+        gray = to_gray(image)
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.max_width / width)
+
+        if self.last_box is not None:
+            x, y, w, h = self.last_box
+            pad_x, pad_y = int(w * self.padding), int(h * self.padding)
+            left, top = max(0, x - pad_x), max(0, y - pad_y)
+            right, bottom = min(width, x + w + pad_x), min(height, y + h + pad_y)
+
+            self.roi_scans += 1
+            faces = self._detect_scaled(gray[top:bottom, left:right], scale, left, top)
+            if len(faces):
+                self._remember(faces)
+                return faces
+            self.roi_misses += 1
+
+        self.full_scans += 1
+        faces = self._detect_scaled(gray, scale)
+        self._remember(faces)
+        return faces
+
+    def stats(self):
+        return {"full_scans": self.full_scans, "roi_scans": self.roi_scans, "roi_misses": self.roi_misses}
@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# How often a process refreshes the heartbeat of its running jobs and looks for work
+HEARTBEAT_SECONDS = 10
+# A running job whose heartbeat is older than this lost its process and is queued again
+STALE_SECONDS = 60
+
+class JobQueue:
+    # Background job runner with a bounded worker pool. Job state lives in SQLite so
+    # the status endpoint survives restarts, and unfinished jobs are resumed on start.
+    # Several processes (e.g. gunicorn workers) may share one database: jobs are claimed
+    # with a single conditional UPDATE, so max_workers bounds the running jobs of all of
+    # them together, and jobs of one user never run concurrently, they share the user's files.
+    def __init__(self, database_path, max_workers=1, heartbeat_seconds=HEARTBEAT_SECONDS,
+                 stale_seconds=STALE_SECONDS):
+        self.database_path = database_path
+        self.max_workers = max_workers
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.handlers = {}
+        self.discards = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )""")
+            # Databases created before jobs were shared between processes
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if 'owner' not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, kind, status)")
+
+    def _owner(self):
+        # Looked up on every use, a queue created before a fork belongs to the child
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per operation keeps sqlite3 happy across threads. The
+        # transaction is committed, or rolled back on an error, and the connection closed.
+        with closing(sqlite3.connect(self.database_path, timeout=30)) as connection, connection:
+            yield connection
+
+    def register(self, kind, handler, discard=None):
+        # discard(user_id, **payload) cleans up after a payload that a newer submit replaced
+        self.handlers[kind] = handler
+        if discard is not None:
+            self.discards[kind] = discard
+
+    def resume(self):
+        # Jobs whose process died (no heartbeat for stale_seconds) are queued again, handlers
+        # must be idempotent. Jobs that live processes are running are left alone. Every
+        # queued job is then offered to this process, and the same happens periodically.
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET status = ?, owner = NULL, started_at = NULL "
+                               "WHERE status = ? AND (heartbeat IS NULL OR heartbeat < ?)",
+                               (QUEUED, RUNNING, time.time() - self.stale_seconds))
+        job_ids = self._start_queued()
+
+        with self.lock:
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+                self.heartbeat_thread.start()
+        return len(job_ids)
+
+    def _start_queued(self):
+        with self._connect() as connection:
+            job_ids = [row[0] for row in connection.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,))]
+        for job_id in job_ids:
+            self.executor.submit(self._run, job_id)
+        return job_ids
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_seconds):
+            try:
+                with self._connect() as connection:
+                    connection.execute("UPDATE jobs SET heartbeat = ? WHERE status = ? AND owner = ?",
+                                       (time.time(), RUNNING, self._owner()))
+                # Picks up the jobs of dead processes and jobs no finishing job started
+                self.resume()
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def submit(self, kind, user_id, **payload):
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind}")
+
+        with self._connect() as connection:
+            # At most one queued job per user and kind: a newer request replaces the
+            # payload of the queued one instead of scheduling the work twice. The write
+            # lock is taken up front, so no process claims the job in between.
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id, payload FROM jobs WHERE user_id = ? AND kind = ? AND status = ?",
+                (user_id, kind, QUEUED)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(payload), row[0]))
+                job_id, replaced = row[0], json.loads(row[1])
+            else:
+                job_id, replaced = uuid.uuid4().hex, None
+                connection.execute(
+                    "INSERT INTO jobs (id, kind, user_id, status, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, user_id, QUEUED, json.dumps(payload), time.time()))
+
+        if replaced is None:
+            self.executor.submit(self._run, job_id)
+        elif kind in self.discards:
+            try:
+                self.discards[kind](user_id, **replaced)
+            except Exception as e:
+                print(f"Could not discard the replaced payload of job {job_id}: {e}")
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _claim(self, job_id):
+        # One statement, so of all processes exactly one wins a job. It is only taken while
+        # its user has no running job and fewer than max_workers jobs run in total.
+        owner, now = self._owner(), time.time()
+        with self._connect() as connection:
+            claimed = connection.execute("""
+                UPDATE jobs SET status = ?, owner = ?, started_at = ?, heartbeat = ?
+                WHERE id = ? AND status = ?
+                  AND NOT EXISTS (SELECT 1 FROM jobs AS other WHERE other.user_id = jobs.user_id AND other.status = ?)
+                  AND (SELECT COUNT(*) FROM jobs WHERE status = ?) < ?""",
+                (RUNNING, owner, now, now, job_id, QUEUED, RUNNING, RUNNING, self.max_workers)).rowcount
+            if not claimed:
+                return None
+            return connection.execute("SELECT kind, user_id, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _run(self, job_id):
+        row = self._claim(job_id)
+        if row is None:
+            # Done or claimed elsewhere, or it stays queued, so newer uploads still replace
+            # its payload, until a running job finishes and offers it again
+            return
+        kind, user_id, payload = row
+
+        try:
+            try:
+                result = self.handlers[kind](user_id, **json.loads(payload))
+                status, result, error = SUCCEEDED, json.dumps(result), None
+            except Exception as e:
+                print(f"Job {job_id} ({kind} for user {user_id}) failed: {e}")
+                status, result, error = FAILED, None, str(e)
+
+            with self._connect() as connection:
+                # A job taken over after a missed heartbeat belongs to its new owner
+                connection.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                                   "WHERE id = ? AND owner = ?",
+                                   (status, result, error, time.time(), job_id, self._owner()))
+        finally:
+            # The user and a worker slot are free again, in any process
+            if not self.stopped.is_set():
+                self._start_queued()
+
+    def shutdown(self, wait=True):
+        self.stopped.set()
+        self.executor.shutdown(wait=wait)
@@ -1,10 +1,21 @@
+import cProfile
 import os
-import cv2
-from flask import Flask, request, jsonify
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request, jsonify, url_for
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
-from model import main as train_model  # Import the main function from model.py
-from showcase import main as verify_image  # Import the main function from showcase.py
+from jobs import JobQueue
+from batching import MicroBatcher
+from model_registry import registry as model_registry
+from face_detection import detection_stats, get_detector
+import metrics
+from video import UploadSpool, archive_faces, collect_face_crops, load_staged_faces, preprocess_faces, stage_faces
+from dataset import load_directory
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS on all routes
@@ -12,6 +23,76 @@ CORS(app)  # Enable CORS on all routes
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['FACES_FOLDER'] = 'faces'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB max file size
+app.config['JOBS_DATABASE'] = 'jobs.sqlite3'
+app.config['PROFILE_FOLDER'] = 'profiles'
+# cProfile dumps per request: 'off', 'header' (only requests sending X-Profile: 1) or 'all'
+app.config['REQUEST_PROFILING'] = os.environ.get('REQUEST_PROFILING', 'off')
+app.config['TRAINING_WORKERS'] = int(os.environ.get('TRAINING_WORKERS', 1))  # Concurrent trainings of all workers
+app.config['STREAMING_UPLOAD'] = os.environ.get('STREAMING_UPLOAD') == '1'  # Extract faces while the video arrives
+app.config['FAST_FACE_DETECTION'] = os.environ.get('FAST_FACE_DETECTION') == '1'  # Downscaled, ROI-tracked detection
+# Train on at most this many of the sharpest, well exposed and distinct extracted faces, 0 keeps them all
+app.config['SELECTED_FACES'] = int(os.environ.get('SELECTED_FACES', 0))
+app.config['VERIFICATION_ENGINE'] = os.environ.get('VERIFICATION_ENGINE', 'classifier')  # 'classifier' or 'embedding'
+app.config['TRAINING_PRECISION'] = os.environ.get('TRAINING_PRECISION', 'float32')  # or 'mixed_bfloat16' / 'mixed_float16'
+app.config['TRAINING_JIT_COMPILE'] = os.environ.get('TRAINING_JIT_COMPILE') == '1'  # XLA-compiled training steps
+app.config['TRAINING_BATCH_SIZE'] = int(os.environ.get('TRAINING_BATCH_SIZE', 32))
+app.config['TRAINING_INTRA_OP_THREADS'] = int(os.environ.get('TRAINING_INTRA_OP_THREADS', 0))  # 0 lets TensorFlow pick
+app.config['TRAINING_INTER_OP_THREADS'] = int(os.environ.get('TRAINING_INTER_OP_THREADS', 0))
+app.config['INCREMENTAL_TRAINING'] = os.environ.get('INCREMENTAL_TRAINING', '1') == '1'  # Fine-tune on re-enrolment
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'keras')  # 'keras' or 'tflite'
+app.config['INFERENCE_MAX_BATCH_SIZE'] = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 16))
+app.config['INFERENCE_MAX_WAIT_MS'] = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))  # How long a request waits for company
+app.config['PRELOAD'] = os.environ.get('PRELOAD') == '1'  # Import TensorFlow and warm up at startup, not on first use
+
+_tensorflow_lock = threading.Lock()
+_tensorflow_loaded = False
+
+def load_tensorflow():
+    # TensorFlow, Keras and sklearn come in with model.py. They are imported by the first
+    # request that needs them, so workers start fast and OpenCV-only endpoints never pay
+    # for them. The training options are applied before TensorFlow runs its first op.
+    global _tensorflow_loaded
+    with _tensorflow_lock:
+        if not _tensorflow_loaded:
+            with metrics.timer('tensorflow_import'):
+                from model import configure_training
+            configure_training(app.config['TRAINING_PRECISION'], app.config['TRAINING_INTRA_OP_THREADS'],
+                               app.config['TRAINING_INTER_OP_THREADS'])
+            _tensorflow_loaded = True
+
+def train_model(*args, **kwargs):
+    load_tensorflow()
+    from model import main
+    return main(*args, **kwargs)
+
+def verify_image(*args, **kwargs):
+    # The TFLite backend runs on the interpreter alone, showcase only sets TensorFlow up
+    # when it falls back to a Keras model
+    if kwargs.get('backend') != 'tflite' or kwargs.get('engine') == 'embedding':
+        load_tensorflow()
+    from showcase import main
+    return main(*args, load_keras=load_tensorflow, **kwargs)
+
+def preload():
+    # Warm-up for production workers: pays the imports and the first model and detector
+    # loads at startup instead of in the first requests. Also usable from a gunicorn
+    # post_fork hook.
+    start = time.perf_counter()
+    load_tensorflow()
+    import showcase
+    get_detector()
+    if app.config['VERIFICATION_ENGINE'] == 'embedding':
+        import embedding
+        if embedding.is_available():
+            model_registry.get(embedding.EMBEDDING_MODEL_PATH)
+    print(f"Preloaded in {time.perf_counter() - start:.1f}s")
+
+def minimum_faces():
+    # Selection drops blurry and repeated crops on purpose, half of the selected
+    # count of distinct faces is still a usable video
+    if app.config['SELECTED_FACES']:
+        return app.config['SELECTED_FACES'] // 2
+    return 249
 
 @app.before_request
 def create_upload_folder():
@@ -20,8 +101,42 @@ def create_upload_folder():
     if not os.path.exists(app.config['FACES_FOLDER']):
         os.makedirs(app.config['FACES_FOLDER'])
 
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+
+    profiling = app.config['REQUEST_PROFILING']
+    if profiling == 'all' or (profiling == 'header' and request.headers.get('X-Profile') == '1'):
+        # Only the request thread is profiled, background jobs and pools are not
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+        endpoint = request.endpoint or 'unmatched'
+        profile_path = os.path.join(app.config['PROFILE_FOLDER'], f"{time.strftime('%Y%m%d-%H%M%S')}_{endpoint}_"
+                                                                 f"{uuid.uuid4().hex[:8]}.prof")
+        profiler.dump_stats(profile_path)
+        response.headers['X-Profile-Path'] = profile_path
+
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.request_seconds.observe(time.perf_counter() - g.request_start, request.method, endpoint,
+                                    response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/users/uploadVideo', methods=['POST'])
 def upload_video():
+    if app.config['STREAMING_UPLOAD'] and request.mimetype == 'multipart/form-data':
+        return upload_video_streaming()
+
     user_id = request.form.get('userId')
     video_file = request.files.get('file')
 
@@ -29,24 +144,122 @@ def upload_video():
         return jsonify(error="User ID and video file are required"), 400
 
     try:
-        filename = secure_filename(f"{user_id}.mp4")
+        # Every upload gets its own file, a queued job may still be waiting on the previous one
+        filename = secure_filename(f"{user_id}_{uuid.uuid4().hex}.mp4")
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        video_file.save(file_path)
+        with metrics.timer('upload_save'):
+            video_file.save(file_path)
 
-        # Call the function to extract faces from the video
-        output_dir = os.path.join(app.config['FACES_FOLDER'], user_id)
-        face_count = split_video_into_faces(file_path, output_dir, frame_rate=150)
+        # Face extraction and training run in the background job queue
+        job_id = job_queue.submit('enroll', user_id, file_path=file_path)
 
-        if face_count < 249:
-            return jsonify(error="The video quality is not good enough, please provide a better/longer video."), 400
+        return jsonify(message="Video uploaded, processing started", jobId=job_id,
+                       statusUrl=url_for('job_status', job_id=job_id)), 202
+    except Exception as e:
+        print(e)
+        return jsonify(error="Video could not be uploaded"), 400
 
-        # Train the model for the specific user
-        train_model(user_id)
+def upload_video_streaming():
+    # Parses the multipart body as it arrives and feeds the video part into a spool that
+    # face extraction reads concurrently. Once 250 faces are found the rest of the video
+    # is neither spooled nor decoded, the body is only drained to reach the userId field.
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        return jsonify(error="User ID and video file are required"), 400
 
-        return jsonify(message="Video uploaded and processed successfully", videoUrl=file_path, facesUrl=output_dir), 200
+    decoder = MultipartDecoder(boundary.encode())
+    fields = {}
+    part = None
+    spool = None
+    extraction = None
+    face_count = 0
+    upload_error = None
+    received = 0
+    faces_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{uuid.uuid4().hex}_faces.npz"))
+
+    try:
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            decoder.receive_data(chunk or None)
+            received += len(chunk)
+
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and event.name == 'file' and spool is None:
+                    part = 'file'
+                    # Everything from this chunk on is an upper bound of the video's size
+                    spool = UploadSpool(app.config['UPLOAD_FOLDER'],
+                                        expected_size=(request.content_length or 0) - received + len(chunk) or None)
+                    extraction = upload_executor.submit(stage_faces, spool, faces_path, frame_rate=150,
+                                                        fast=app.config['FAST_FACE_DETECTION'],
+                                                        keep=app.config['SELECTED_FACES'] or None)
+                elif isinstance(event, (Field, File)):
+                    part = event.name
+                    fields[part] = b''
+                elif isinstance(event, Data):
+                    if part == 'file':
+                        if not extraction.done():
+                            spool.append(event.data)
+                    elif len(fields[part]) < 1024:
+                        fields[part] += event.data
+                event = decoder.next_event()
+
+            if not chunk or isinstance(event, Epilogue):
+                break
     except Exception as e:
         print(e)
+        upload_error = e
+    finally:
+        if spool is not None:
+            spool.finish()
+            try:
+                face_count = extraction.result()
+            except Exception as e:
+                # An undecodable video fails here, it is a bad upload and not a server error
+                print(e)
+                upload_error = upload_error or e
+            finally:
+                spool.close()
+
+    user_id = fields.get('userId', b'').decode(errors='replace') or request.args.get('userId')
+    if (upload_error is not None or not user_id or face_count < minimum_faces()) and os.path.exists(faces_path):
+        os.remove(faces_path)
+    if upload_error is not None:
         return jsonify(error="Video could not be uploaded"), 400
+    if not user_id or spool is None:
+        return jsonify(error="User ID and video file are required"), 400
+
+    if face_count < minimum_faces():
+        return jsonify(error="The video quality is not good enough, please provide a better/longer video."), 400
+
+    # Training runs in the background job queue on the faces extracted above
+    job_id = job_queue.submit('enroll', user_id, faces_path=faces_path)
+
+    return jsonify(message="Video uploaded, processing started", jobId=job_id,
+                   statusUrl=url_for('job_status', job_id=job_id)), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+
+    if job is None:
+        return jsonify(error="Job not found"), 404
+
+    return jsonify(jobId=job['id'], userId=job['user_id'], status=job['status'], result=job['result'],
+                   error=job['error'], createdAt=job['created_at'], startedAt=job['started_at'],
+                   finishedAt=job['finished_at']), 200
+
+@app.route('/models/cache', methods=['GET'])
+def model_cache_stats():
+    return jsonify(model_registry.stats()), 200
+
+@app.route('/detection/stats', methods=['GET'])
+def face_detection_stats():
+    return jsonify(detection_stats()), 200
+
+@app.route('/inference/stats', methods=['GET'])
+def inference_stats():
+    return jsonify(inference_batcher.stats()), 200
 
 @app.route('/users/uploadImage', methods=['POST'])
 def upload_image():
@@ -57,12 +270,13 @@ def upload_image():
         return jsonify(error="User ID and image file are required"), 400
 
     try:
-        filename = secure_filename(image_file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file.save(file_path)
+        with metrics.timer('upload_read'):
+            image_data = image_file.read()
 
-        # Verify the image against the user's model
-        result = verify_image(user_id, file_path)
+        # Verify the image against the user's model. It is decoded in memory, so concurrent
+        # requests share no files and the probe never lands in a training folder.
+        result = verify_image(user_id, image_data, engine=app.config['VERIFICATION_ENGINE'], batcher=inference_batcher,
+                              backend=app.config['INFERENCE_BACKEND'])
 
         # Check if the user ID matches and confidence is greater than 0.9
         if result.get('success') and result.get('message', '').startswith(f"Image matches the class {user_id}") and result.get('confidence', 0) > 0.9:
@@ -74,81 +288,99 @@ def upload_image():
         return jsonify(error="Image could not be uploaded or processed"), 400
 
 
-def split_video_into_faces(video_path, output_dir, frame_rate=150):
-    # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Load the Haar Cascade for face detection
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
-    # Open the video file
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        print(f"Error: Could not open video {video_path}")
-        return 0
-
-    # Get the original frame rate of the video
-    original_fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    if original_fps <= 0:
-        print(f"Error: Invalid frame rate {original_fps} for video {video_path}")
-        return 0
-    
-    if frame_rate <= 0:
-        print(f"Error: Frame rate must be greater than zero")
-        return 0
-
-    frame_count = 0
-    face_count = 0
-    max_faces = 250  # Maximum number of faces to extract
-
-    while True:
-        # Read a frame
-        ret, frame = cap.read()
-
-        # If the frame was not retrieved properly, break the loop
-        if not ret:
-            break
-
-        # Check if the current frame should be processed based on the desired frame rate
-        if frame_count % max(1, int(original_fps // frame_rate)) == 0:
-            # Convert frame to grayscale as face detection works on grayscale images
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            # Detect faces
-            faces = face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,  # How much the image size is reduced at each image scale
-                minNeighbors=15,  # How many neighbors each candidate rectangle should have to retain it
-                minSize=(64, 64),  # Minimum possible object size
-                flags=cv2.CASCADE_SCALE_IMAGE
-            )
-
-            for (x, y, w, h) in faces:
-                # Crop the face region
-                face = frame[y:y+h, x:x+w]
-                
-                # Construct the output face file path
-                face_filename = os.path.join(output_dir, f"face_{face_count:04d}.jpg")
-                
-                # Save the face image
-                cv2.imwrite(face_filename, face)
-                face_count += 1
-
-                # Stop if we have reached the maximum number of faces
-                if face_count >= max_faces:
-                    cap.release()
-                    print(f"Extracted {face_count} faces to {output_dir}")
-                    return face_count
-
-        frame_count += 1
-
-    # Release the video capture object
-    cap.release()
-    print(f"Extracted {face_count} faces to {output_dir}")
-    return face_count
+def replace_faces(staging_dir, output_dir):
+    # Swaps a complete set of archived faces in for the user's previous ones. A selected
+    # enrolment can have fewer faces than the last one, none of those may linger.
+    if os.path.isdir(output_dir):
+        previous_dir = f"{staging_dir}.old"
+        os.replace(output_dir, previous_dir)
+        os.replace(staging_dir, output_dir)
+        shutil.rmtree(previous_dir, ignore_errors=True)
+    else:
+        os.replace(staging_dir, output_dir)
+
+def enroll_user(user_id, file_path=None, faces_path=None):
+    output_dir = os.path.join(app.config['FACES_FOLDER'], user_id)
+    # Hidden, so it is never taken for an enrolled user
+    staging_dir = os.path.join(app.config['FACES_FOLDER'], f".{secure_filename(user_id)}_{uuid.uuid4().hex}")
+
+    # The new faces overwrite the archived ones, keep the previous enrolment for replay
+    previous_faces = None
+    if app.config['INCREMENTAL_TRAINING'] and os.path.isdir(output_dir):
+        previous_faces = load_directory(output_dir, os.path.join(app.config['FACES_FOLDER'], '.cache'))
+
+    if faces_path is not None:
+        # Faces were already extracted while a streaming upload arrived, the video was not kept
+        video_path = None
+        crops = load_staged_faces(faces_path)
+        os.remove(faces_path)
+    else:
+        # Keep the latest upload under the user's name, as before the job queue existed
+        video_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{user_id}.mp4"))
+        if os.path.exists(file_path):
+            os.replace(file_path, video_path)
+
+        crops = collect_face_crops(video_path, frame_rate=150, fast=app.config['FAST_FACE_DETECTION'],
+                                   keep=app.config['SELECTED_FACES'] or None)
+
+    # A failed enrolment leaves the user's archived faces as they were
+    if len(crops) < minimum_faces():
+        raise ValueError("The video quality is not good enough, please provide a better/longer video.")
+
+    # Training runs on the in-memory batch, the JPEGs are archived in the background and
+    # swapped in once all of them are written
+    faces = preprocess_faces(crops)
+
+    def swap_in(future):
+        if future.exception() is None:
+            replace_faces(staging_dir, output_dir)
+        else:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    archive_faces(crops, staging_dir).add_done_callback(swap_in)
+
+    load_tensorflow()
+    if app.config['VERIFICATION_ENGINE'] == 'embedding':
+        import embedding
+        use_embedding = embedding.is_available()
+    else:
+        use_embedding = False
+
+    if use_embedding:
+        # Enrolment is a forward pass through the shared embedding model
+        embedding.enroll(user_id, faces)
+    else:
+        # Train the model for the specific user
+        train_model(user_id, faces=faces, warm_start=app.config['INCREMENTAL_TRAINING'],
+                    previous_faces=previous_faces, batch_size=app.config['TRAINING_BATCH_SIZE'],
+                    jit_compile=app.config['TRAINING_JIT_COMPILE'])
+
+    return {"videoUrl": video_path, "facesUrl": output_dir}
+
+def discard_enrollment(user_id, file_path=None, faces_path=None):
+    # A newer upload replaced this queued enrolment, nothing will read its files any more
+    for path in (file_path, faces_path):
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+inference_batcher = MicroBatcher(max_batch_size=app.config['INFERENCE_MAX_BATCH_SIZE'],
+                                 max_wait_ms=app.config['INFERENCE_MAX_WAIT_MS'])
+# Evicted models must also leave the batcher's cache of traced functions, which holds them
+model_registry.add_eviction_listener(inference_batcher.forget)
+
+upload_executor = ThreadPoolExecutor(thread_name_prefix='upload')
+
+metrics.register_gauges('face_model_cache', model_registry.stats,
+                        counters=('hits', 'misses', 'evictions', 'invalidations'))
+metrics.register_gauges('face_detection', detection_stats, counters=('calls', 'images', 'faces', 'seconds'))
+metrics.register_gauges('face_inference', inference_batcher.stats, counters=('requests', 'batches'))
+
+job_queue = JobQueue(app.config['JOBS_DATABASE'], max_workers=app.config['TRAINING_WORKERS'])
+job_queue.register('enroll', enroll_user, discard=discard_enrollment)
+job_queue.resume()
+
+if app.config['PRELOAD']:
+    preload()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
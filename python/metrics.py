@@ -0,0 +1,95 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight instrumentation for the face service. Stage timers feed histograms that
+# /metrics serves in the Prometheus text format, nothing is exported or pushed.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    def __init__(self, name, description, label_names=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [per-bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self.lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.series.items()]
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, total, count in sorted(series):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts + [count - sum(counts)]):
+                cumulative += bucket_count
+                bucket_labels = ','.join(labels + ['le="%s"' % bound])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+stage_seconds = Histogram('face_stage_seconds', "Time spent in each stage of the face pipeline", ['stage'])
+request_seconds = Histogram('face_http_request_seconds', "Time to answer an HTTP request",
+                            ['method', 'endpoint', 'status'])
+
+def observe(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+
+@contextmanager
+def timer(stage):
+    # Times a block, or a whole function when used as a decorator
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage)
+
+_gauges = []
+
+def register_gauges(prefix, function, counters=()):
+    # function returns a dict of current numeric values, e.g. a component's stats().
+    # The keys in counters only ever grow (hits, requests, ...) and are exported as
+    # <prefix>_<key>_total counters so rate() works on them, the rest as gauges.
+    _gauges.append((prefix, function, frozenset(counters)))
+
+def render():
+    lines = stage_seconds.render() + request_seconds.render()
+    for prefix, function, counters in _gauges:
+        for key, value in function().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if key in counters:
+                    lines.append(f"# TYPE {prefix}_{key}_total counter")
+                    lines.append(f"{prefix}_{key}_total {value}")
+                else:
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+    return '\n'.join(lines) + '\n'
+
+def peak_rss_mb():
+    # ru_maxrss is inherited from the parent across fork on Linux, VmHWM belongs to this process
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+    except (OSError, StopIteration):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -1,4 +1,8 @@
+import json
 import os
+import time
+from functools import lru_cache
+import cv2
 import numpy as np
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
@@ -7,30 +11,75 @@ from tensorflow.keras.utils import Sequence
 from tensorflow.keras import layers, models
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
 from collections import Counter
+from dataset import load_directory
+from storage import atomic_write
+import metrics
 
-def rotate_image(image, angle):
+@lru_cache(maxsize=64)
+def _rotation_maps(height, width, angle, mode):
+    # Inverse mapping from every output pixel back into the source image. The
+    # maps only depend on the shape and angle, so they are built once and reused.
     angle = np.deg2rad(angle)
     cos_theta, sin_theta = np.cos(angle), np.sin(angle)
-    height, width = image.shape[:2]
-    
+
     new_width = int(np.abs(height * sin_theta) + np.abs(width * cos_theta))
     new_height = int(np.abs(height * cos_theta) + np.abs(width * sin_theta))
-    
-    new_image = np.zeros((new_height, new_width, image.shape[2]), dtype=image.dtype)
-    
+
     old_center = np.array([height // 2, width // 2])
     new_center = np.array([new_height // 2, new_width // 2])
-    
-    for i in range(new_height):
-        for j in range(new_width):
-            y, x = i - new_center[0], j - new_center[1]
-            old_x = int(x * cos_theta + y * sin_theta + old_center[1])
-            old_y = int(-x * sin_theta + y * cos_theta + old_center[0])
-            
-            if 0 <= old_x < width and 0 <= old_y < height:
-                new_image[i, j] = image[old_y, old_x]
-    
-    return new_image
+
+    y, x = np.indices((new_height, new_width))
+    y = y - new_center[0]
+    x = x - new_center[1]
+    old_x = x * cos_theta + y * sin_theta + old_center[1]
+    old_y = -x * sin_theta + y * cos_theta + old_center[0]
+
+    if mode == 'nearest':
+        # astype truncates towards zero, exactly like int() in the original loop
+        old_x = old_x.astype(np.int64)
+        old_y = old_y.astype(np.int64)
+        valid = (old_x >= 0) & (old_x < width) & (old_y >= 0) & (old_y < height)
+        maps = (np.flatnonzero(valid), old_y[valid] * width + old_x[valid])
+    elif mode == 'bilinear':
+        x0 = np.floor(old_x).astype(np.int64)
+        y0 = np.floor(old_y).astype(np.int64)
+        dx = (old_x - x0).ravel()
+        dy = (old_y - y0).ravel()
+        x0, y0 = x0.ravel(), y0.ravel()
+
+        maps = []
+        for oy, ox, weight in ((0, 0, (1 - dx) * (1 - dy)), (0, 1, dx * (1 - dy)),
+                               (1, 0, (1 - dx) * dy), (1, 1, dx * dy)):
+            yy, xx = y0 + oy, x0 + ox
+            valid = (xx >= 0) & (xx < width) & (yy >= 0) & (yy < height)
+            maps.append((np.flatnonzero(valid), yy[valid] * width + xx[valid], weight[valid]))
+        maps = tuple(maps)
+    else:
+        raise ValueError(f"Unknown interpolation mode {mode}")
+
+    return (new_height, new_width), maps
+
+def rotate_image(image, angle, mode='nearest', cache=True):
+    height, width = image.shape[:2]
+    build_maps = _rotation_maps if cache else _rotation_maps.__wrapped__
+    (new_height, new_width), maps = build_maps(height, width, float(angle), mode)
+
+    source = image.reshape(height * width, image.shape[2])
+    new_image = np.zeros((new_height * new_width, image.shape[2]), dtype=image.dtype)
+
+    if mode == 'nearest':
+        target, index = maps
+        new_image[target] = source[index]
+    else:
+        accumulated = np.zeros(new_image.shape, dtype=np.float64)
+        for target, index, weight in maps:
+            accumulated[target] += source[index] * weight[:, None]
+        if np.issubdtype(image.dtype, np.integer):
+            info = np.iinfo(image.dtype)
+            accumulated = np.clip(np.rint(accumulated), info.min, info.max)
+        new_image[:] = accumulated
+
+    return new_image.reshape(new_height, new_width, image.shape[2])
 
 def mirror_image(image):
     return np.flip(image, axis=1)
@@ -39,127 +88,386 @@ def change_brightness(image, value):
     image_brightness = np.clip(image + value, 0, 255).astype(np.uint8)
     return image_brightness
 
-def add_noise(image, mean=0, var=10):
+def add_noise(image, mean=0, var=10, rng=None):
     row, col, ch = image.shape
     sigma = var ** 0.5
-    gauss = np.random.normal(mean, sigma, (row, col, ch))
+    if rng is None:
+        gauss = np.random.normal(mean, sigma, (row, col, ch))
+    else:
+        gauss = rng.normal(mean, sigma, (row, col, ch))
     noisy = image + gauss
     noisy = np.clip(noisy, 0, 255).astype(np.uint8)
     return noisy
 
+# Number of fixed variants produced by custom_augmentation
+CUSTOM_AUGMENTATIONS = 4
+
+def _to_pixels(image):
+    # The augmentation helpers work on 0-255 pixels, training images are normalized floats
+    if np.issubdtype(image.dtype, np.floating):
+        return np.clip(np.rint(image * 255.0), 0, 255).astype(np.uint8)
+    return image
+
+def _from_pixels(pixels, like):
+    if np.issubdtype(like.dtype, np.floating):
+        return (pixels / 255.0).astype(like.dtype)
+    return np.clip(np.rint(pixels), 0, 255).astype(like.dtype)
+
+def _center_crop(image, height, width):
+    top = (image.shape[0] - height) // 2
+    left = (image.shape[1] - width) // 2
+    return image[top:top + height, left:left + width]
+
+def augment_variant(image, variant, rng=None):
+    # Variant 0 is the image itself, variants 1-4 are the fixed custom augmentations
+    # and every further variant is a random shift/rotate/zoom/mirror of the image.
+    # The result always has the shape, dtype and value range of the input.
+    if variant == 0:
+        return image
+
+    pixels = _to_pixels(image)
+    if variant == 1:
+        pixels = _center_crop(rotate_image(pixels, 10), *image.shape[:2])
+    elif variant == 2:
+        pixels = mirror_image(pixels)
+    elif variant == 3:
+        pixels = change_brightness(pixels, 3)
+    elif variant == 4:
+        pixels = add_noise(pixels, rng=rng)
+    else:
+        rng = rng if rng is not None else np.random.default_rng()
+        pixels = augment_batch(pixels[None] / 255.0, rng)[0] * 255.0
+
+    return _from_pixels(pixels, image)
+
 def custom_augmentation(image):
-    augmented_images = []
-    
-    augmented_images.append(rotate_image(image, 10))
-    
-    augmented_images.append(mirror_image(image))
-    
-    augmented_images.append(change_brightness(image, 3))
-    
-    augmented_images.append(add_noise(image))
-    
-    return augmented_images
+    return [augment_variant(image, variant) for variant in range(1, CUSTOM_AUGMENTATIONS + 1)]
+
+def random_custom_augmentation(image):
+    # ImageDataGenerator expects exactly one image back from its preprocessing_function
+    return augment_variant(image, np.random.randint(1, CUSTOM_AUGMENTATIONS + 1))
 
 data_augmentation = ImageDataGenerator(
     width_shift_range=0.2,
     height_shift_range=0.2,
     rotation_range=20,
     zoom_range=0.2,
-    preprocessing_function=custom_augmentation
+    preprocessing_function=random_custom_augmentation
 )
 
-def fetch_image_data(user_directory, unknown_directory):
+def fetch_image_data(user_directory, unknown_directory, cache_directory=None, user_images=None):
     images = []
     labels = []
     
     for directory in [user_directory, unknown_directory]:
         class_label = os.path.basename(directory)
-        image_files = filter(lambda f: f.endswith(('.jpg', '.png', '.jpeg')), os.listdir(directory))
+        if directory == user_directory and user_images is not None:
+            # Faces handed over in memory by the extraction step
+            directory_images = user_images
+        else:
+            directory_images = load_directory(directory, cache_directory)
+        images.append(directory_images)
+        labels.extend([class_label] * len(directory_images))
         
-        for image_file in image_files:
-            full_image_path = os.path.join(directory, image_file).replace('\\', '/')
-            image = tf.keras.preprocessing.image.load_img(full_image_path, target_size=(64, 64), color_mode='grayscale')
-            image = tf.keras.preprocessing.image.img_to_array(image) / 255.0
-            images.append(image)
-            labels.append(class_label)
-        
-    return np.array(images), np.array(labels)
+    return np.concatenate(images), np.array(labels)
+
+def augment_batch(images, rng, rotation_range=20, width_shift_range=0.2, height_shift_range=0.2,
+                  zoom_range=0.2, horizontal_flip=True, brightness_delta=3 / 255.0,
+                  noise_std=10 ** 0.5 / 255.0):
+    # Applies a random shift/rotate/zoom/mirror/brightness/noise to every image of an
+    # (N, H, W, C) batch of normalized images at once instead of one warp per image.
+    images = np.asarray(images, dtype=np.float32)
+    batch_size, height, width, channels = images.shape
+
+    theta = np.deg2rad(rng.uniform(-rotation_range, rotation_range, batch_size)).astype(np.float32)
+    shift_x = (rng.uniform(-width_shift_range, width_shift_range, batch_size) * width).astype(np.float32)
+    shift_y = (rng.uniform(-height_shift_range, height_shift_range, batch_size) * height).astype(np.float32)
+    zoom_x = rng.uniform(1 - zoom_range, 1 + zoom_range, batch_size).astype(np.float32)
+    zoom_y = rng.uniform(1 - zoom_range, 1 + zoom_range, batch_size).astype(np.float32)
+    if horizontal_flip:
+        # Mirroring is folded into the affine map by negating the x zoom
+        zoom_x = np.where(rng.random(batch_size) < 0.5, -zoom_x, zoom_x)
+
+    # Inverse affine map from output pixel to source pixel around the image center
+    cos_theta, sin_theta = np.cos(theta)[:, None, None], np.sin(theta)[:, None, None]
+    center_y, center_x = (height - 1) / 2.0, (width - 1) / 2.0
+    y, x = np.indices((height, width), dtype=np.float32)
+    y -= center_y
+    x -= center_x
+
+    source_x = (cos_theta * x - sin_theta * y) * zoom_x[:, None, None] + (center_x + shift_x[:, None, None])
+    source_y = (sin_theta * x + cos_theta * y) * zoom_y[:, None, None] + (center_y + shift_y[:, None, None])
+
+    # Pixels outside the image repeat the nearest edge pixel. Clamping per image
+    # lets the whole batch be sampled as one tall image in a single remap call.
+    np.clip(source_x, 0, width - 1, out=source_x)
+    np.clip(source_y, 0, height - 1, out=source_y)
+    source_y += (np.arange(batch_size, dtype=np.float32) * height)[:, None, None]
+
+    augmented = cv2.remap(images.reshape(batch_size * height, width, channels),
+                          source_x.reshape(batch_size * height, width),
+                          source_y.reshape(batch_size * height, width),
+                          cv2.INTER_LINEAR)
+    augmented = augmented.reshape(batch_size, height, width, channels)
+
+    if brightness_delta:
+        augmented += rng.uniform(-brightness_delta, brightness_delta, (batch_size, 1, 1, 1)).astype(np.float32)
+    if noise_std:
+        augmented += np.float32(noise_std) * rng.standard_normal(augmented.shape, dtype=np.float32)
+
+    return np.clip(augmented, 0.0, 1.0, out=augmented)
 
 class DataGenerator(Sequence):
-    def __init__(self, images, labels, batch_size=32, augment=False, **kwargs):
+    # drop_remainder skips the last partial batch, which training wants (every step sees a
+    # full batch). Validation keeps it, otherwise a batch size larger than the validation
+    # set would leave nothing to validate on.
+    def __init__(self, images, labels, batch_size=32, augment=False, seed=None, fan_out=1, drop_remainder=False,
+                 **kwargs):
         super().__init__(**kwargs)
         self.images = images
         self.labels = labels
         self.batch_size = batch_size
         self.augment = augment
-        self.indices = np.arange(len(images))
-        self.on_epoch_end()
+        self.drop_remainder = drop_remainder
+        self.seed = seed
+        self.fan_out = fan_out
+        self.epoch = 0
+        self.augmented_count = 0
+        self.augmentation_time = 0.0
+        # Each index addresses one (source image, variant) pair, variants are built on demand
+        self.indices = np.arange(len(images) * fan_out)
+        self.rng = np.random.default_rng(seed)
+        self.rng.shuffle(self.indices)
         
     def __len__(self):
-        return int(np.floor(len(self.images) / self.batch_size))
+        if self.drop_remainder:
+            return len(self.indices) // self.batch_size
+        return int(np.ceil(len(self.indices) / self.batch_size))
     
     def __getitem__(self, index):
         indices = self.indices[index*self.batch_size:(index+1)*self.batch_size]
-        batch_images = [self.images[i] for i in indices]
-        batch_labels = [self.labels[i] for i in indices]
-        
-        if self.augment:
-            batch_images = np.array([data_augmentation.random_transform(img) for img in batch_images])
+        sources, variants = np.divmod(indices, self.fan_out)
+        batch_labels = np.asarray(self.labels[sources])
+
+        # Seeded batches depend only on (seed, epoch, index), so they are
+        # reproducible no matter in which order Keras requests them
+        if self.seed is None:
+            rng = self.rng
+        else:
+            rng = np.random.default_rng([self.seed, self.epoch, index])
+
+        start = time.perf_counter()
+        if self.fan_out > 1:
+            # The variants replace the random augmentation, variants past the custom
+            # ones are already random transforms and are not augmented a second time
+            batch_images = np.stack([augment_variant(self.images[source], variant, rng)
+                                     for source, variant in zip(sources, variants)])
+        elif self.augment:
+            batch_images = augment_batch(self.images[sources], rng)
+        else:
+            batch_images = np.asarray(self.images[sources])
+
+        if self.augment or self.fan_out > 1:
+            seconds = time.perf_counter() - start
+            self.augmentation_time += seconds
+            self.augmented_count += len(batch_images)
+            # One observation per batch on the metrics endpoint
+            metrics.observe('augmentation', seconds)
         
-        return np.array(batch_images), np.array(batch_labels)
+        return batch_images, batch_labels
+
+    def augmentation_throughput(self):
+        return self.augmented_count / self.augmentation_time if self.augmentation_time else 0.0
     
     def on_epoch_end(self):
-        np.random.shuffle(self.indices)
+        self.epoch += 1
+        self.rng.shuffle(self.indices)
 
-def create_model(kernel_size, num_classes):
-    model = models.Sequential()
-    
+def add_backbone(model, kernel_size, width=32, dropout=0.25):
+    # Convolutional feature extractor shared by the per-user classifier and the embedding model.
+    # width is the number of filters of the first block, every block doubles it.
     model.add(layers.Input(shape=(64, 64, 1)))
-    model.add(layers.Conv2D(32, kernel_size, activation='gelu', padding='same'))
-    model.add(layers.Conv2D(32, kernel_size, activation='gelu', padding='same'))
+    model.add(layers.Conv2D(width, kernel_size, activation='gelu', padding='same'))
+    model.add(layers.Conv2D(width, kernel_size, activation='gelu', padding='same'))
     model.add(layers.MaxPooling2D((2, 2)))
-    model.add(layers.Dropout(0.25))
+    model.add(layers.Dropout(dropout))
     
-    model.add(layers.Conv2D(64, kernel_size, activation='gelu', padding='same'))
-    model.add(layers.Conv2D(64, kernel_size, activation='gelu', padding='same'))
+    model.add(layers.Conv2D(width * 2, kernel_size, activation='gelu', padding='same'))
+    model.add(layers.Conv2D(width * 2, kernel_size, activation='gelu', padding='same'))
     model.add(layers.MaxPooling2D((2, 2)))
-    model.add(layers.Dropout(0.25))
+    model.add(layers.Dropout(dropout))
     
-    model.add(layers.Conv2D(128, kernel_size, activation='gelu', padding='same'))
-    model.add(layers.Conv2D(128, kernel_size, activation='gelu', padding='same'))
+    model.add(layers.Conv2D(width * 4, kernel_size, activation='gelu', padding='same'))
+    model.add(layers.Conv2D(width * 4, kernel_size, activation='gelu', padding='same'))
     model.add(layers.MaxPooling2D((2, 2)))
-    model.add(layers.Dropout(0.25))
+    model.add(layers.Dropout(dropout))
     
     model.add(layers.Flatten())
     model.add(layers.Dense(128, activation='tanh'))
-    model.add(layers.Dense(num_classes, activation='softmax'))
+    return model
+
+def create_model(kernel_size, num_classes, width=32, dropout=0.25):
+    model = models.Sequential()
+    
+    add_backbone(model, kernel_size, width, dropout)
+    # The softmax stays in float32 under mixed precision for a stable loss
+    model.add(layers.Dense(num_classes, activation='softmax', dtype='float32'))
     
     return model
 
-def train_and_evaluate_model(model, train_gen, val_gen, test_images, test_labels):
-    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+# Architecture of a user's model when no sweep picked one
+DEFAULT_ARCHITECTURE = {'kernel_size': (3, 3), 'width': 32, 'dropout': 0.25}
+
+def load_architecture(user_directory):
+    # The setting sweep.py kept for the user, retraining and warm starts build the same model
+    try:
+        with open(f'{user_directory}_architecture.json') as f:
+            architecture = json.load(f)
+    except FileNotFoundError:
+        return dict(DEFAULT_ARCHITECTURE)
+    return {'kernel_size': tuple(architecture['kernel_size']), 'width': architecture['width'],
+            'dropout': architecture['dropout']}
+
+def save_architecture(user_directory, kernel_size, width, dropout):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump({'kernel_size': list(kernel_size), 'width': width, 'dropout': dropout}, f)
+
+    atomic_write(f'{user_directory}_architecture.json', write)
+
+def configure_training(precision='float32', intra_op_threads=0, inter_op_threads=0):
+    # Process-wide TensorFlow settings, call before the first model is built.
+    # precision is 'float32', 'mixed_float16' or 'mixed_bfloat16' (bfloat16 is the one
+    # CPUs with AVX512-BF16/AMX speed up). 0 threads lets TensorFlow pick.
+    tf.keras.mixed_precision.set_global_policy(precision)
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        # Thread pools can only be sized before TensorFlow starts executing ops
+        print(f"Warning: Could not configure TensorFlow threads: {e}")
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    # Reports the duration of every training epoch to the metrics endpoint and keeps them in times
+    def on_train_begin(self, logs=None):
+        self.times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.times.append(time.perf_counter() - self.start)
+        metrics.observe('training_epoch', self.times[-1])
+
+def train_and_evaluate_model(model, train_gen, val_gen, test_images, test_labels, epochs=20, learning_rate=0.001,
+                             patience=5, jit_compile=False):
+    # jit_compile compiles the training step with XLA
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'], jit_compile=jit_compile)
     
-    history = model.fit(train_gen, epochs=20, validation_data=val_gen, 
-                        callbacks=[EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True), 
-                                   ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=0.0001)])
+    history = model.fit(train_gen, epochs=epochs, validation_data=val_gen, 
+                        callbacks=[EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True), 
+                                   ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=max(1, patience - 2),
+                                                     min_lr=min(learning_rate, 0.0001)),
+                                   EpochTimer()])
     
     _, test_acc = model.evaluate(test_images, test_labels)
     
     return history, test_acc
 
-def main(user_id):
+# Warm-start fine-tuning keeps the first conv blocks fixed and only adapts the rest
+FROZEN_BLOCKS = 2
+# Share of the previous enrolment's faces replayed next to the new ones
+REPLAY_FRACTION = 0.5
+
+def warm_start_model(kernel_size, num_classes, model_paths, width=32, dropout=0.25):
+    # Builds a classifier initialized from the first existing model in model_paths,
+    # either the user's previous model or a shared backbone such as the embedding
+    # model. Layers are matched by position and copied while their weights fit.
+    for path in model_paths:
+        if not os.path.exists(path):
+            continue
+        source = models.load_model(path)
+        model = create_model(kernel_size, num_classes, width, dropout)
+        copied = 0
+        for target_layer, source_layer in zip(model.layers, source.layers):
+            source_weights = source_layer.get_weights()
+            if [w.shape for w in source_weights] != [w.shape for w in target_layer.get_weights()]:
+                break
+            target_layer.set_weights(source_weights)
+            copied += 1
+        if copied:
+            print(f"Warm start from {path}, {copied}/{len(model.layers)} layers initialized")
+            return model
+        # A different architecture, e.g. an embedding backbone of another width than the user's model
+        print(f"Warm start skipped {path}, its layers do not match")
+    return None
+
+def freeze_blocks(model, blocks=FROZEN_BLOCKS):
+    # A block ends with its pooling layer, everything up to the last frozen block stops training
+    for layer in model.layers:
+        if blocks <= 0:
+            break
+        layer.trainable = False
+        if isinstance(layer, layers.MaxPooling2D):
+            blocks -= 1
+    return model
+
+def save_model(model, model_path):
+    # A concurrent verification never loads a half-written file
+    atomic_write(model_path, model.save)
+
+@metrics.timer('tflite_export')
+def export_tflite(model, model_path, quantization='float16', representative_images=None):
+    # Exports a quantized TFLite copy of the model for the lightweight verification backend.
+    # 'float16' halves the weights, 'int8' quantizes them to 8 bits using
+    # representative_images to calibrate the activations.
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if representative_images is None:
+            raise ValueError("int8 quantization needs representative images")
+        converter.representative_dataset = lambda: ([image[np.newaxis].astype(np.float32)]
+                                                    for image in representative_images[:200])
+    elif quantization is not None:
+        raise ValueError(f"Unknown quantization {quantization}")
+
+    content = converter.convert()
+
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    atomic_write(model_path, write)
+
+def main(user_id, fan_out=1, faces=None, tflite_quantization='float16', warm_start=False, previous_faces=None,
+         batch_size=32, jit_compile=False):
+    # warm_start fine-tunes the user's existing model (or the shared embedding backbone)
+    # instead of training from scratch. previous_faces are the faces of the last
+    # enrolment, a sample of them is replayed so the model does not forget them.
+    start_time = time.perf_counter()
     base_directory = r'faces'
     base_directory = os.path.abspath(base_directory)
     user_directory = os.path.join(base_directory, user_id)
     unknown_directory = os.path.join(base_directory, 'unknown')
 
-    # Ensure the directories exist
-    if not os.path.isdir(user_directory) or not os.path.isdir(unknown_directory):
+    # Ensure the directories exist, the user's faces may also be passed in memory
+    if (faces is None and not os.path.isdir(user_directory)) or not os.path.isdir(unknown_directory):
         raise ValueError("User directory or unknown directory does not exist")
 
-    kernel_sizes = [(3, 3)]
+    architecture = load_architecture(user_directory)
+    kernel_sizes = [architecture['kernel_size']]
     
-    train_images, train_labels = fetch_image_data(user_directory, unknown_directory)
+    cache_directory = os.path.join(base_directory, '.cache')
+    if warm_start and faces is not None and previous_faces is not None and len(previous_faces):
+        rng = np.random.default_rng()
+        replay = rng.choice(len(previous_faces), min(len(previous_faces), int(len(faces) * REPLAY_FRACTION)),
+                            replace=False)
+        faces = np.concatenate([faces, previous_faces[replay]])
+        print(f"Replaying {len(replay)} faces of the previous enrolment for user {user_id}")
+    train_images, train_labels = fetch_image_data(user_directory, unknown_directory, cache_directory, faces)
 
     label_encoder = {label: idx for idx, label in enumerate(np.unique(train_labels))}
     train_labels = np.array([label_encoder[label] for label in train_labels])
@@ -173,22 +481,52 @@ def main(user_id):
     train_images = train_images.reshape(-1, 64, 64, 1)
     val_images = val_images.reshape(-1, 64, 64, 1)
 
-    train_gen = DataGenerator(train_images, train_labels, augment=True)
-    val_gen = DataGenerator(val_images, val_labels, augment=False)
+    train_gen = DataGenerator(train_images, train_labels, batch_size=batch_size, augment=True, fan_out=fan_out,
+                              drop_remainder=True)
+    val_gen = DataGenerator(val_images, val_labels, batch_size=batch_size, augment=False)
 
     accuracies = {}
+    best_model, best_acc = None, -1.0
+    # Whether a previous model was actually found, warm_start only asks for it
+    warm_started = False
 
     for kernel_size in kernel_sizes:
-        model = create_model(kernel_size, len(np.unique(train_labels)))
-        history, test_acc = train_and_evaluate_model(model, train_gen, val_gen, val_images, val_labels)
+        num_classes = len(np.unique(train_labels))
+        model = None
+        if warm_start:
+            model = warm_start_model(kernel_size, num_classes, [
+                f'{user_directory}_face_model.keras',
+                os.path.join(base_directory, 'embedding_model.keras'),
+            ], architecture['width'], architecture['dropout'])
+
+        if model is not None:
+            warm_started = True
+            freeze_blocks(model)
+            history, test_acc = train_and_evaluate_model(model, train_gen, val_gen, val_images, val_labels,
+                                                         epochs=8, learning_rate=0.0003, patience=2,
+                                                         jit_compile=jit_compile)
+        else:
+            model = create_model(kernel_size, num_classes, architecture['width'], architecture['dropout'])
+            history, test_acc = train_and_evaluate_model(model, train_gen, val_gen, val_images, val_labels,
+                                                         jit_compile=jit_compile)
         accuracies[kernel_size] = test_acc
         
-        model.save(f'{user_directory}_face_model.keras')
+        # Only the most accurate kernel size is kept, sweep.py runs larger searches in parallel
+        if test_acc > best_acc:
+            best_model, best_acc = model, test_acc
+            save_model(model, f'{user_directory}_face_model.keras')
+            if tflite_quantization:
+                export_tflite(model, f'{user_directory}_face_model.tflite', tflite_quantization, train_images)
+    model = best_model
 
     # Print final accuracies
     print(f"Final Test Accuracies for different kernel sizes for user {user_id}:")
     for kernel_size, acc in accuracies.items():
         print(f"Kernel Size {kernel_size}: Test Accuracy = {acc:.4f}")
+    training_time = time.perf_counter() - start_time
+    metrics.observe('training', training_time)
+    print(f"Training time ({'warm start' if warm_started else 'from scratch'}): {training_time:.1f}s")
+    print(f"Augmentation throughput (fan-out {fan_out}): {train_gen.augmentation_throughput():.1f} images/s")
 
     # Evaluate on known data
     print(f"\nEvaluating on known training data for user {user_id}:")
@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import metrics
+
+def load_keras_model(path):
+    # Imported on first use so registries of TFLite models never pull in TensorFlow
+    from tensorflow.keras import models
+    return models.load_model(path)
+
+class ModelRegistry:
+    # Process-wide LRU cache of loaded models keyed by file path. An entry is reloaded
+    # when the file's mtime changes, so a retrained model is picked up automatically.
+    # The limits default to MODEL_CACHE_SIZE models and MODEL_CACHE_BYTES bytes of weights
+    def __init__(self, max_models=None, max_bytes=None, loader=None):
+        self.max_models = max_models or int(os.environ.get('MODEL_CACHE_SIZE', 8))
+        self.max_bytes = max_bytes or int(os.environ.get('MODEL_CACHE_BYTES', 512 * 1024 * 1024))
+        self.loader = loader or load_keras_model
+        self.entries = OrderedDict()  # path -> (mtime_ns, model, size_bytes)
+        self.lock = threading.Lock()
+        self.load_locks = {}
+        self.eviction_listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        model = self._lookup(path, mtime_ns)
+        if model is not None:
+            return model
+
+        # Only one thread loads a given file, the others wait and reuse its result
+        with self.lock:
+            load_lock = self.load_locks.setdefault(path, threading.Lock())
+        with load_lock:
+            model = self._lookup(path, mtime_ns, count=False)
+            if model is not None:
+                return model
+
+            with metrics.timer('model_load'):
+                model = self.loader(path)
+                self._warm_up(model)
+            size = self._size(model)
+
+            with self.lock:
+                self.misses += 1
+                dropped = []
+                if path in self.entries:
+                    self.invalidations += 1
+                    dropped.append(self.entries.pop(path)[1])
+                self.entries[path] = (mtime_ns, model, size)
+                dropped.extend(self._evict())
+            self._notify(dropped)
+            print(f"Loaded model {path} ({size / 1024 / 1024:.1f} MB of weights)")
+            return model
+
+    def _lookup(self, path, mtime_ns, count=True):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != mtime_ns:
+                return None
+            self.entries.move_to_end(path)
+            if count:
+                self.hits += 1
+            return entry[1]
+
+    def _evict(self):
+        # Least recently used first, the newest entry always stays. Returns the evicted models.
+        evicted = []
+        while len(self.entries) > 1 and (len(self.entries) > self.max_models or self.total_bytes() > self.max_bytes):
+            evicted.append(self.entries.popitem(last=False)[1][1])
+            self.evictions += 1
+        return evicted
+
+    def add_eviction_listener(self, listener):
+        # listener(model) is called for every model the registry stops holding, so caches
+        # keyed by the model (like the batcher's traced functions) can let it go too
+        self.eviction_listeners.append(listener)
+
+    def _notify(self, models):
+        for model in models:
+            for listener in self.eviction_listeners:
+                listener(model)
+
+    def _size(self, model):
+        # Exported models report their own size, Keras models are measured by their weights
+        if hasattr(model, 'nbytes'):
+            return model.nbytes
+        return sum(weight.nbytes for weight in model.get_weights())
+
+    def _warm_up(self, model):
+        # Builds the predict function once so the first real request does not pay for it
+        model.predict(np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32), verbose=0)
+
+    def total_bytes(self):
+        return sum(size for _, _, size in self.entries.values())
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                dropped = [model for _, model, _ in self.entries.values()]
+                self.entries.clear()
+            else:
+                entry = self.entries.pop(os.path.abspath(path), None)
+                dropped = [entry[1]] if entry is not None else []
+        self._notify(dropped)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": len(self.entries),
+                "bytes": self.total_bytes(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+registry = ModelRegistry()
@@ -0,0 +1,110 @@
+import time
+import cv2
+import numpy as np
+import metrics
+
+# Cheap per-crop quality checks for enrolment videos. Consecutive frames of a
+# recording give near-identical faces and some crops are blurred by motion, so
+# only the sharpest distinct faces are kept for training.
+
+# Variance of the Laplacian of the 64x64 grayscale face, below it a crop is too blurry
+MIN_SHARPNESS = 100.0
+# Mean grey level a usable crop falls into
+BRIGHTNESS_RANGE = (40, 215)
+# Crops whose 64-bit difference hashes differ in at most this many bits are duplicates
+MAX_HASH_DISTANCE = 10
+
+def face_quality(crop):
+    # Returns the sharpness and brightness of a BGR or grayscale crop, measured at
+    # the 64x64 size the models see, and the downscaled grayscale face
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    gray = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    return sharpness, gray.mean(), gray
+
+def difference_hash(gray):
+    # 64-bit dHash as a bool array: whether each pixel of a 9x8 thumbnail is brighter
+    # than its right neighbour
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return (small[:, 1:] > small[:, :-1]).flatten()
+
+class FaceSelector:
+    # Collects the crops that pass the quality checks, then picks max_faces of them:
+    # the sharpest crop of every group of near-duplicates first, and if that leaves
+    # room, crops spread evenly over the rest of the video. Sharpness only filters,
+    # ranking by it would favour one pose and lighting.
+    def __init__(self, max_faces, min_sharpness=MIN_SHARPNESS, brightness_range=BRIGHTNESS_RANGE,
+                 max_hash_distance=MAX_HASH_DISTANCE):
+        self.max_faces = max_faces
+        self.min_sharpness = min_sharpness
+        self.brightness_range = brightness_range
+        self.max_hash_distance = max_hash_distance
+        self.crops = []
+        self.sharpness = []
+        self.hashes = []
+        self.offered = 0
+        self.blurry = 0
+        self.badly_exposed = 0
+        self.distinct = 0
+
+    def offer(self, crop):
+        self.offered += 1
+        sharpness, brightness, gray = face_quality(crop)
+        if sharpness < self.min_sharpness:
+            self.blurry += 1
+            return False
+        if not self.brightness_range[0] <= brightness <= self.brightness_range[1]:
+            self.badly_exposed += 1
+            return False
+
+        self.crops.append(crop)
+        self.sharpness.append(sharpness)
+        self.hashes.append(difference_hash(gray))
+        return True
+
+    def faces(self):
+        # The picked crops in the order they were offered
+        if not self.crops:
+            return []
+        hashes = np.array(self.hashes)
+        # Sharpest first, so of several near-duplicates the sharpest is picked
+        order = np.argsort(-np.array(self.sharpness), kind='stable')
+        hashes = hashes[order]
+        distance = np.full(len(order), hashes.shape[1] + 1)
+        indices = set()
+        for position, index in enumerate(order.tolist()):
+            if len(indices) >= self.max_faces:
+                break
+            if distance[position] > self.max_hash_distance:
+                indices.add(index)
+                np.minimum(distance, np.count_nonzero(hashes != hashes[position], axis=1), out=distance)
+        self.distinct = len(indices)
+
+        rest = [index for index in range(len(self.crops)) if index not in indices]
+        missing = min(self.max_faces - len(indices), len(rest))
+        if missing > 0:
+            indices.update(rest[int(position)] for position in np.linspace(0, len(rest) - 1, missing))
+        return [self.crops[index] for index in sorted(indices)]
+
+    def stats(self):
+        return {'offered': self.offered, 'accepted': len(self.crops), 'distinct': self.distinct,
+                'blurry': self.blurry, 'badly_exposed': self.badly_exposed}
+
+def select_faces(crops, max_faces, **kwargs):
+    # Consumes an iterable of crops and returns the selected ones
+    selector = FaceSelector(max_faces, **kwargs)
+    seconds = 0.0
+    for crop in crops:
+        start = time.perf_counter()
+        selector.offer(crop)
+        seconds += time.perf_counter() - start
+
+    start = time.perf_counter()
+    faces = selector.faces()
+    seconds += time.perf_counter() - start
+    metrics.observe('face_selection', seconds)
+
+    stats = selector.stats()
+    print(f"Kept {len(faces)} of {stats['offered']} faces, {stats['distinct']} of them distinct "
+          f"({stats['blurry']} blurry, {stats['badly_exposed']} badly exposed) in {seconds:.2f}s")
+    return faces
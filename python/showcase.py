@@ -1,73 +1,93 @@
 import os
 import sys
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras import models
+from model_registry import registry
 import cv2
+from dataset import preprocess_face
+from face_detection import detect_faces
+import metrics
 
-def split_image_into_faces(image_path, output_dir):
-    # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Load the Haar Cascade for face detection
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
-    # Read the image
-    image = cv2.imread(image_path)
-    
-    if image is None:
-        print(f"Error: Could not read image {image_path}")
-        return None
-
+def crop_face(image):
     # Convert image to grayscale as face detection works on grayscale images
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # Detect faces
-    faces = face_cascade.detectMultiScale(
-        gray,
-        scaleFactor=1.1,  # How much the image size is reduced at each image scale
-        minNeighbors=10,  # How many neighbors each candidate rectangle should have to retain it
-        minSize=(64, 64),  # Minimum possible object size
-        flags=cv2.CASCADE_SCALE_IMAGE
-    )
+    # Detect faces with the shared per-thread detector
+    faces = detect_faces(gray, min_neighbors=10)
 
     for (x, y, w, h) in faces:
         # Crop the face region
-        face = image[y:y+h, x:x+w]
-        
-        # Construct the output face file path
-        face_filename = os.path.join(output_dir, "face.jpg")
-        
-        # Save the face image
-        cv2.imwrite(face_filename, face)
-        print(f"Extracted face to {face_filename}")
-        return face_filename
+        return image[y:y+h, x:x+w]
 
     print("No face detected")
     return None
 
+def read_image(image):
+    # image is a file path or the encoded bytes of an upload, which are decoded in
+    # memory so verification writes nothing to disk
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # imdecode asserts on an empty buffer instead of returning None
+        image = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR) if len(image) else None
+        if image is None:
+            print("Error: Could not decode the uploaded image")
+        return image
+
+    decoded = cv2.imread(image)
+    if decoded is None:
+        print(f"Error: Could not read image {image}")
+    return decoded
+
+@metrics.timer('face_extraction')
+def extract_face(image):
+    # Returns the preprocessed tensor of the first face in a file path or in encoded image bytes
+    image = read_image(image)
+    if image is None:
+        return None
+
+    face = crop_face(image)
+    if face is None:
+        return None
+    return preprocess_face(face)
+
 def load_sample_image_from_class(train_images_path, class_id):
     class_folder = os.path.join(train_images_path, class_id).replace('//', '/')
-    for file_name in os.listdir(class_folder):
+    try:
+        file_names = os.listdir(class_folder)
+    except FileNotFoundError:
+        # Swapped out by a re-enrolment of the user, replace_faces puts the new folder back right after
+        return None
+    for file_name in file_names:
         if file_name.endswith(('.jpg', '.png', '.jpeg')):
             image_path = os.path.join(class_folder, file_name).replace('//', '/')
-            image = tf.keras.preprocessing.image.load_img(image_path, target_size=(64, 64), color_mode='grayscale')
-            image = tf.keras.preprocessing.image.img_to_array(image)
+            # Same as Keras' load_img(color_mode='grayscale'), without importing TensorFlow
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                # Removed by a re-enrolment of the user in the meantime
+                continue
+            image = cv2.resize(image, (64, 64), interpolation=cv2.INTER_NEAREST)
+            image = image[..., np.newaxis].astype(np.float32)
             image /= 255.0  # Normalize the image
             return image
     return None
 
 # Define the visualization function
 def display_image(image_path, model, class_labels, train_images_path, confidence_threshold=0.80):
+    import tensorflow as tf  # Imported on first use, verification does not need it
     image = tf.keras.preprocessing.image.load_img(image_path, target_size=(64, 64), color_mode='grayscale')
     image = tf.keras.preprocessing.image.img_to_array(image)
     image /= 255.0  # Normalize the image
     
-    image_expanded = np.expand_dims(image, axis=0)  # Add batch dimension
-    prediction = model.predict(image_expanded)
+    return classify_face(image, model, class_labels, train_images_path, confidence_threshold)
+
+def classify_face(image, model, class_labels, train_images_path, confidence_threshold=0.80, batcher=None):
+    with metrics.timer('predict'):
+        if batcher is not None:
+            # Grouped with concurrent verifications into one batched call
+            prediction = batcher.predict(model, image)[np.newaxis]
+        else:
+            image_expanded = np.expand_dims(image, axis=0)  # Add batch dimension
+            prediction = model.predict(image_expanded)
     predicted_class = np.argmax(prediction)
-    confidence = np.max(prediction)
+    confidence = float(np.max(prediction))
     
     print(f"Prediction raw output: {prediction}")
     
@@ -86,25 +106,48 @@ def display_image(image_path, model, class_labels, train_images_path, confidence
             return {"message": "No sample image found for comparison.", "success": False, "confidence": confidence}
 
 
-def main(user_id, image_path):
+def main(user_id, image, engine='classifier', batcher=None, backend='keras', load_keras=None):
+    # image is the path of the probe image or its encoded bytes. load_keras is called
+    # before a Keras model is loaded, so the caller can set TensorFlow up first.
     base_directory = r'faces'
     base_directory = os.path.abspath(base_directory)
+
+    # The engine and backend modules are imported on first use, so TensorFlow is only
+    # loaded by the ones that need it
+    if engine == 'embedding':
+        import embedding
+        if embedding.is_available() and user_id in embedding.index:
+            # Shared embedding model and the user's prototypes, no per-user model to load
+            face = extract_face(image)
+            if face is None:
+                return {"error": "No face image to display.", "success": False}
+            return embedding.verify(user_id, face, batcher=batcher)
+
     model_path = os.path.join(base_directory, f'{user_id}_face_model.keras')
     
     if not os.path.exists(model_path):
         return {"error": f"Model for user {user_id} does not exist.", "success": False}
     
-    # Load the pre-trained model
-    model = models.load_model(model_path)
+    # Load the pre-trained model, repeated logins are served from the registry cache
+    model = None
+    if backend == 'tflite':
+        import tflite_backend
+        if os.path.exists(tflite_backend.tflite_path(model_path)):
+            # Quantized export running on the small TFLite interpreter
+            model = tflite_backend.registry.get(tflite_backend.tflite_path(model_path))
+    if model is None:
+        # Also the fallback of the TFLite backend for models that were never exported
+        if load_keras is not None:
+            load_keras()
+        model = registry.get(model_path)
 
     # Define class labels (update this list based on your actual class labels)
     class_labels = [user_id, "unknown"]  # Update based on your folder names
     
-    output_dir = os.path.join(base_directory, user_id)
-    face_image_path = split_image_into_faces(image_path, output_dir)
+    face = extract_face(image)
 
-    if face_image_path:
-        return display_image(face_image_path, model, class_labels, base_directory)
+    if face is not None:
+        return classify_face(face, model, class_labels, base_directory, batcher=batcher)
     else:
         return {"error": "No face image to display.", "success": False}
 
@@ -0,0 +1,17 @@
+import os
+import threading
+
+def atomic_write(path, writer):
+    # writer(temporary_path) writes the file next to path, then it is swapped in, so a
+    # concurrent reader never sees a half-written file and watchers see a single mtime
+    # change. The temporary name is unique per process and thread, concurrent writers of
+    # one file never share it, and keeps the extension, which Keras and numpy go by.
+    root, extension = os.path.splitext(path)
+    temporary_path = f"{root}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+    try:
+        writer(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
@@ -0,0 +1,148 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+# Hyperparameter sweep for a user's face model. Every setting trains in its own
+# process with a fixed CPU budget. The decoded faces are put into shared memory
+# once and mapped by the workers instead of being pickled into each of them.
+
+_arrays = {}
+
+def _share(array):
+    memory = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, array.dtype, buffer=memory.buf)[:] = array
+    return memory, (memory.name, array.shape, array.dtype.str)
+
+def _init_worker(shared, cpus_per_worker):
+    from model import configure_training
+    configure_training(intra_op_threads=cpus_per_worker, inter_op_threads=1)
+
+    for key, (name, shape, dtype) in shared.items():
+        # Spawned workers share the parent's resource tracker, the parent unlinks the segments
+        memory = shared_memory.SharedMemory(name=name)
+        _arrays[key] = (memory, np.ndarray(shape, dtype, buffer=memory.buf))
+
+def _train_setting(setting, epochs, model_path):
+    import tensorflow as tf
+    from model import DataGenerator, create_model, save_model, train_and_evaluate_model
+
+    train_images, train_labels = _arrays['train_images'][1], _arrays['train_labels'][1]
+    val_images, val_labels = _arrays['val_images'][1], _arrays['val_labels'][1]
+
+    start = time.perf_counter()
+    train_gen = DataGenerator(train_images, train_labels, augment=True, drop_remainder=True)
+    val_gen = DataGenerator(val_images, val_labels, augment=False)
+    model = create_model(setting['kernel_size'], len(np.unique(train_labels)), setting['width'], setting['dropout'])
+    history, accuracy = train_and_evaluate_model(model, train_gen, val_gen, val_images, val_labels, epochs=epochs)
+    seconds = time.perf_counter() - start
+
+    save_model(model, model_path)
+    tf.keras.backend.clear_session()
+    return dict(setting, accuracy=float(accuracy), epochs=len(history.history['loss']), seconds=seconds,
+                model_path=model_path)
+
+def sweep(user_id, kernel_sizes=((3, 3), (5, 5)), widths=(16, 32), dropouts=(0.25, 0.4), cpus_per_worker=1,
+          epochs=20, tflite_quantization='float16'):
+    from model import export_tflite, fetch_image_data, save_architecture
+    from tensorflow.keras import models
+
+    base_directory = os.path.abspath('faces')
+    user_directory = os.path.join(base_directory, user_id)
+    unknown_directory = os.path.join(base_directory, 'unknown')
+    if not os.path.isdir(user_directory) or not os.path.isdir(unknown_directory):
+        raise ValueError("User directory or unknown directory does not exist")
+
+    images, labels = fetch_image_data(user_directory, unknown_directory, os.path.join(base_directory, '.cache'))
+    label_encoder = {label: idx for idx, label in enumerate(np.unique(labels))}
+    labels = np.array([label_encoder[label] for label in labels])
+
+    # One split for every setting so the accuracies are comparable
+    train_images, val_images, train_labels, val_labels = train_test_split(
+        images.reshape(-1, 64, 64, 1), labels, test_size=0.2, stratify=labels, random_state=0)
+
+    settings = [{'kernel_size': kernel_size, 'width': width, 'dropout': dropout}
+                for kernel_size, width, dropout in itertools.product(kernel_sizes, widths, dropouts)]
+    workers = max(1, min(len(settings), (os.cpu_count() or 1) // cpus_per_worker))
+    print(f"Sweeping {len(settings)} settings for user {user_id} on {workers} workers "
+          f"with {cpus_per_worker} CPUs each")
+
+    memories = []
+    shared = {}
+    results = []
+    sweep_paths = [f'{user_directory}_sweep_{index}.keras' for index in range(len(settings))]
+    model_path = f'{user_directory}_face_model.keras'
+    start = time.perf_counter()
+    try:
+        for key, array in [('train_images', train_images), ('train_labels', train_labels),
+                           ('val_images', val_images), ('val_labels', val_labels)]:
+            memory, shared[key] = _share(np.ascontiguousarray(array))
+            memories.append(memory)
+
+        # TensorFlow is not fork-safe, workers start from a fresh interpreter
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(shared, cpus_per_worker)) as executor:
+            futures = [executor.submit(_train_setting, setting, epochs, path)
+                       for setting, path in zip(settings, sweep_paths)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                print(f"Kernel Size {result['kernel_size']}, width {result['width']}, dropout {result['dropout']}: "
+                      f"Test Accuracy = {result['accuracy']:.4f} in {result['seconds']:.1f}s")
+        total_seconds = time.perf_counter() - start
+
+        # Keep only the best model under the path verification loads from, and its setting
+        # so retraining and warm starts build the same architecture
+        results.sort(key=lambda result: (-result['accuracy'], result['seconds']))
+        best = results[0]
+        os.replace(best['model_path'], model_path)
+        save_architecture(user_directory, best['kernel_size'], best['width'], best['dropout'])
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+        # The other settings' models, also the finished ones when a worker failed
+        for path in sweep_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    if tflite_quantization:
+        export_tflite(models.load_model(model_path), f'{user_directory}_face_model.tflite', tflite_quantization,
+                      train_images)
+
+    table_path = f'{user_directory}_sweep.csv'
+    with open(table_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['kernel_size', 'width', 'dropout', 'accuracy', 'epochs', 'seconds'])
+        for result in results:
+            writer.writerow([f"{result['kernel_size'][0]}x{result['kernel_size'][1]}", result['width'],
+                             result['dropout'], f"{result['accuracy']:.4f}", result['epochs'],
+                             f"{result['seconds']:.1f}"])
+
+    print(f"\n{'kernel':>7} {'width':>6} {'dropout':>8} {'accuracy':>9} {'epochs':>7} {'seconds':>8}")
+    for result in results:
+        print(f"{result['kernel_size'][0]}x{result['kernel_size'][1]:<5} {result['width']:>6} {result['dropout']:>8} "
+              f"{result['accuracy']:>9.4f} {result['epochs']:>7} {result['seconds']:>8.1f}")
+    print(f"Sweep took {total_seconds:.1f}s ({sum(result['seconds'] for result in results):.1f}s of training), "
+          f"kept {best['kernel_size']}, width {best['width']}, dropout {best['dropout']} as {model_path}")
+    print(f"Results written to {table_path}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep for a user's face model")
+    parser.add_argument('user_id')
+    parser.add_argument('--kernel-sizes', type=int, nargs='+', default=[3, 5])
+    parser.add_argument('--widths', type=int, nargs='+', default=[16, 32])
+    parser.add_argument('--dropouts', type=float, nargs='+', default=[0.25, 0.4])
+    parser.add_argument('--cpus-per-worker', type=int, default=1)
+    parser.add_argument('--epochs', type=int, default=20)
+    args = parser.parse_args()
+
+    sweep(args.user_id, [(size, size) for size in args.kernel_sizes], args.widths, args.dropouts,
+          args.cpus_per_worker, args.epochs)
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+# The service modules live one folder up and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    # main.py keeps its uploads, faces and job database relative to the working directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp('app'))
+        import main
+        yield main
+        main.job_queue.shutdown()
@@ -0,0 +1,105 @@
+import gc
+import threading
+import weakref
+import numpy as np
+import tensorflow as tf
+from batching import MicroBatcher
+from model_registry import ModelRegistry
+
+class FakeModel:
+    # Not a Keras model, so the batcher calls predict with the whole group
+    input_shape = (None, 64, 64, 1)
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.batches = []
+
+    def predict(self, images):
+        self.batches.append(len(images))
+        return images.reshape(len(images), -1)[:, :1] + self.offset
+
+def predict_concurrently(batcher, requests):
+    # requests: (model, value) pairs, all submitted at the same moment
+    barrier = threading.Barrier(len(requests))
+    results = [None] * len(requests)
+
+    def submit(position, model, value):
+        barrier.wait()
+        results[position] = batcher.predict(model, np.full((64, 64, 1), value, dtype=np.float32))
+
+    threads = [threading.Thread(target=submit, args=(position, model, value))
+               for position, (model, value) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def small_model():
+    inputs = tf.keras.Input((64, 64, 1))
+    outputs = tf.keras.layers.Dense(2)(tf.keras.layers.Flatten()(inputs))
+    return tf.keras.Model(inputs, outputs)
+
+def test_batched_prediction_matches_the_model():
+    model = small_model()
+    image = np.random.default_rng(0).random((64, 64, 1), dtype=np.float32)
+    output = MicroBatcher(max_wait_ms=1).predict(model, image)
+    np.testing.assert_allclose(output, model.predict(image[None], verbose=0)[0], rtol=1e-5, atol=1e-5)
+
+def test_evicted_model_is_freed(tmp_path):
+    for name in 'ab':
+        (tmp_path / f'{name}.keras').write_bytes(b'model')
+    registry = ModelRegistry(loader=lambda path: small_model(), max_models=1)
+    batcher = MicroBatcher(max_wait_ms=1)
+    registry.add_eviction_listener(batcher.forget)
+
+    image = np.zeros((64, 64, 1), dtype=np.float32)
+    model = registry.get(str(tmp_path / 'a.keras'))
+    batcher.predict(model, image)
+    assert model in batcher.functions
+    reference = weakref.ref(model)
+    del model
+
+    batcher.predict(registry.get(str(tmp_path / 'b.keras')), image)
+    assert len(batcher.functions) == 1
+    gc.collect()
+    assert reference() is None
+
+def test_traced_functions_are_bounded():
+    batcher = MicroBatcher(max_wait_ms=1, max_functions=2)
+    image = np.zeros((64, 64, 1), dtype=np.float32)
+    models = [small_model() for _ in range(3)]
+    for model in models:
+        batcher.predict(model, image)
+    assert list(batcher.functions) == models[1:]
+
+def test_concurrent_requests_for_one_model_share_a_call():
+    model = FakeModel(0)
+    batcher = MicroBatcher(max_batch_size=8, max_wait_ms=2000)
+    results = predict_concurrently(batcher, [(model, value) for value in range(8)])
+
+    # The batch is full before the wait is over
+    assert model.batches == [8]
+    assert [float(result[0]) for result in results] == list(range(8))
+
+def test_models_are_not_mixed_in_one_call():
+    first, second = FakeModel(100), FakeModel(200)
+    batcher = MicroBatcher(max_batch_size=6, max_wait_ms=2000)
+    results = predict_concurrently(batcher, [(first if value % 2 else second, value) for value in range(6)])
+
+    assert first.batches == [3] and second.batches == [3]
+    assert [float(result[0]) for result in results] == [value + (100 if value % 2 else 200) for value in range(6)]
+
+def test_stats_report_batches_and_latency_percentiles():
+    model = FakeModel(0)
+    batcher = MicroBatcher(max_batch_size=4, max_wait_ms=500)
+    predict_concurrently(batcher, [(model, value) for value in range(4)])
+    batcher.predict(model, np.zeros((64, 64, 1), dtype=np.float32))
+
+    stats = batcher.stats()
+    assert stats['requests'] == 5
+    assert stats['batches'] == 2
+    assert stats['batch_sizes'] == {1: 1, 4: 1}
+    assert stats['mean_batch_size'] == 2.5
+    assert 0 < stats['p50_ms'] <= stats['p99_ms']
+    assert stats['max_batch_size'] == 4 and stats['max_wait_ms'] == 500
@@ -0,0 +1,81 @@
+import os
+import cv2
+import numpy as np
+import pytest
+import dataset
+from dataset import load_directory
+
+def write_face(directory, name, seed):
+    image = np.random.default_rng(seed).integers(0, 256, (80, 80), dtype=np.uint8)
+    cv2.imwrite(str(directory / name), image)
+    return image
+
+@pytest.fixture
+def decoded(monkeypatch):
+    # The names of the files that were actually decoded
+    names = []
+    decode_file = dataset._decode_file
+
+    def counting_decode(path):
+        names.append(os.path.basename(path))
+        return decode_file(path)
+
+    monkeypatch.setattr(dataset, '_decode_file', counting_decode)
+    return names
+
+def test_cache_hit_decodes_nothing(tmp_path, decoded):
+    faces, cache = tmp_path / 'faces', tmp_path / 'cache'
+    faces.mkdir()
+    for index in range(3):
+        write_face(faces, f'face_{index}.png', index)
+
+    first = load_directory(str(faces), str(cache))
+    assert decoded == ['face_0.png', 'face_1.png', 'face_2.png']
+    second = load_directory(str(faces), str(cache))
+    assert decoded == ['face_0.png', 'face_1.png', 'face_2.png']
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_array_equal(second, load_directory(str(faces)))
+
+def test_modified_deleted_and_added_files(tmp_path, decoded):
+    faces, cache = tmp_path / 'faces', tmp_path / 'cache'
+    faces.mkdir()
+    for index in range(3):
+        write_face(faces, f'face_{index}.png', index)
+    load_directory(str(faces), str(cache))
+    decoded.clear()
+
+    write_face(faces, 'face_1.png', 10)
+    os.utime(faces / 'face_1.png', ns=(0, os.stat(faces / 'face_1.png').st_mtime_ns + 10 ** 9))
+    os.remove(faces / 'face_2.png')
+    write_face(faces, 'face_3.png', 3)
+    images = load_directory(str(faces), str(cache))
+
+    assert sorted(decoded) == ['face_1.png', 'face_3.png']
+    assert images.shape == (3, 64, 64, 1)
+    np.testing.assert_array_equal(images, load_directory(str(faces)))
+
+def test_touched_but_unchanged_file_is_not_decoded(tmp_path, decoded):
+    faces, cache = tmp_path / 'faces', tmp_path / 'cache'
+    faces.mkdir()
+    write_face(faces, 'face_0.png', 0)
+    load_directory(str(faces), str(cache))
+    os.utime(faces / 'face_0.png', ns=(0, os.stat(faces / 'face_0.png').st_mtime_ns + 10 ** 9))
+
+    load_directory(str(faces), str(cache))
+    assert decoded == ['face_0.png']
+
+def test_empty_directory(tmp_path):
+    faces, cache = tmp_path / 'faces', tmp_path / 'cache'
+    faces.mkdir()
+    assert load_directory(str(faces)).shape == (0, 64, 64, 1)
+    # Without a cache yet, and served from the cache written by the first call
+    assert load_directory(str(faces), str(cache)).shape == (0, 64, 64, 1)
+    assert load_directory(str(faces), str(cache)).shape == (0, 64, 64, 1)
+
+def test_cache_of_an_emptied_directory(tmp_path):
+    faces, cache = tmp_path / 'faces', tmp_path / 'cache'
+    faces.mkdir()
+    write_face(faces, 'face_0.png', 0)
+    load_directory(str(faces), str(cache))
+    os.remove(faces / 'face_0.png')
+    assert load_directory(str(faces), str(cache)).shape == (0, 64, 64, 1)
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pytest
+import embedding
+from embedding import PrototypeIndex, compute_prototypes
+
+def unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+@pytest.fixture
+def fixed_embeddings(tmp_path, monkeypatch):
+    # The "faces" are their own embeddings, the index lives in tmp_path
+    monkeypatch.setattr(embedding, 'embed', lambda faces, batcher=None: unit(np.reshape(faces, (-1, 3))))
+    monkeypatch.setattr(embedding, 'index', PrototypeIndex(str(tmp_path / 'prototypes')))
+
+def test_prototypes_are_the_normalized_cluster_centers():
+    rng = np.random.default_rng(0)
+    first = unit([1, 0, 0] + rng.normal(0, 0.05, (20, 3)))
+    second = unit([0, 1, 0] + rng.normal(0, 0.05, (20, 3)))
+    prototypes = compute_prototypes(np.concatenate([first, second]), count=2)
+
+    assert prototypes.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(prototypes, axis=1), 1.0, rtol=1e-5)
+    nearest = sorted(np.argmax(prototypes, axis=1).tolist())
+    assert nearest == [0, 1]
+    # Never more prototypes than embeddings
+    assert len(compute_prototypes(first[:3], count=5)) == 3
+
+def test_index_round_trip_and_reload(tmp_path):
+    index = PrototypeIndex(str(tmp_path / 'prototypes'))
+    assert index.load('42') is None and '42' not in index
+
+    prototypes = unit([[1, 0, 0], [0, 1, 0]])
+    index.save('42', prototypes)
+    assert '42' in index
+    np.testing.assert_array_equal(index.load('42'), prototypes)
+    assert index.load('42') is index.load('42')
+
+    # A re-enrolment is picked up from the changed file
+    index.save('42', unit([[0, 0, 1]]))
+    path = os.path.join(index.directory, '42.npy')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(index.load('42'), unit([[0, 0, 1]]))
+
+    for user_id in ('../42', '.cache'):
+        with pytest.raises(ValueError):
+            index.save(user_id, prototypes)
+
+def test_verify_accepts_close_faces(fixed_embeddings):
+    assert embedding.verify('42', [1, 0, 0]) == {"error": "User 42 is not enrolled.", "success": False}
+    embedding.enroll('42', [[1, 0, 0]] * 5 + [[1, 0.1, 0]] * 5, count=2)
+
+    result = embedding.verify('42', [1, 0.05, 0])
+    assert result['success'] and result['confidence'] > 0.99
+    assert result['message'] == "Image matches the class 42."
+
+def test_verify_threshold(fixed_embeddings):
+    embedding.enroll('42', [[1, 0, 0]] * 5, count=1)
+    # cos(30 degrees) is about 0.87, below the 0.9 threshold
+    result = embedding.verify('42', [np.cos(np.pi / 6), np.sin(np.pi / 6), 0])
+    assert not result['success'] and 0.85 < result['confidence'] < 0.9
+    assert embedding.verify('42', [np.cos(np.pi / 6), np.sin(np.pi / 6), 0], threshold=0.8)['success']
+
+def test_verify_must_beat_the_unknown_prototypes(fixed_embeddings):
+    embedding.enroll('42', [[1, 0, 0]] * 5, count=1)
+    embedding.enroll('unknown', [[1, 0.2, 0]] * 5, count=1)
+
+    # Above the threshold for the user, but even closer to someone in the unknown set
+    probe = [1, 0.25, 0]
+    result = embedding.verify('42', probe)
+    assert result['confidence'] > 0.9 and not result['success']
+    assert embedding.verify('42', [1, -0.1, 0])['success']
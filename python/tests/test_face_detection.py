@@ -0,0 +1,64 @@
+import os
+import threading
+import cv2
+import numpy as np
+from face_detection import detect_faces, detection_stats, get_detector
+
+SAMPLE_FACE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'faces', 'unknown', '1 (1).jpg')
+
+def frame_with_face(x, y, width=640, height=480, face_height=288):
+    # A sample face pasted on a noisy background, like the benchmark's synthetic videos
+    face = cv2.imread(SAMPLE_FACE)
+    scale = face_height / face.shape[0]
+    face = cv2.resize(face, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    frame = np.random.default_rng(0).integers(90, 140, (height, width, 3), dtype=np.uint8)
+    frame[y:y + face.shape[0], x:x + face.shape[1]] = face
+    return frame, face.shape[1], face.shape[0]
+
+def test_detector_is_one_instance_per_thread():
+    detector = get_detector()
+    assert get_detector() is detector
+
+    others = []
+    thread = threading.Thread(target=lambda: others.append(get_detector()))
+    thread.start()
+    thread.join()
+    assert others[0] is not detector
+
+def test_detection_finds_the_face_and_counts_it():
+    frame, face_width, face_height = frame_with_face(100, 96)
+    before = detection_stats()
+    faces = detect_faces(frame, min_neighbors=15)
+    after = detection_stats()
+
+    assert len(faces) == 1
+    x, y, w, h = faces[0]
+    assert 100 < x + w / 2 < 100 + face_width and 96 < y + h / 2 < 96 + face_height
+    assert after['calls'] == before['calls'] + 1
+    assert after['images'] == before['images'] + 1
+    assert after['faces'] == before['faces'] + 1
+    assert after['mean_ms'] > 0 and after['max_ms'] >= after['mean_ms']
+    assert len(detect_faces(np.full((480, 640), 120, dtype=np.uint8))) == 0
+
+def test_tracker_searches_around_the_last_face():
+    from face_detection import FaceTracker
+
+    # Wider than max_width, so detection runs downscaled and boxes are mapped back
+    tracker = FaceTracker(max_width=640)
+    frame, face_width, face_height = frame_with_face(300, 200, width=1280, height=720, face_height=400)
+    faces = tracker.detect(frame)
+    assert len(faces) == 1
+    x, y, w, h = faces[0]
+    assert 300 < x + w / 2 < 300 + face_width and 200 < y + h / 2 < 200 + face_height
+    assert tracker.stats() == {'full_scans': 1, 'roi_scans': 0, 'roi_misses': 0}
+
+    # The face moved a little, it is found in the region around the last box
+    frame, _, _ = frame_with_face(340, 220, width=1280, height=720, face_height=400)
+    assert len(tracker.detect(frame)) == 1
+    assert tracker.stats() == {'full_scans': 1, 'roi_scans': 1, 'roi_misses': 0}
+
+    # The face jumped to the other side, the region misses and the full frame is rescanned
+    frame, face_width, _ = frame_with_face(900, 200, width=1280, height=720, face_height=400)
+    faces = tracker.detect(frame)
+    assert len(faces) == 1 and 900 < faces[0][0] + faces[0][2] / 2 < 900 + face_width
+    assert tracker.stats() == {'full_scans': 2, 'roi_scans': 2, 'roi_misses': 1}
@@ -0,0 +1,193 @@
+import sqlite3
+import threading
+import time
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+def wait_for(job_queue, job_id, statuses=(SUCCEEDED, FAILED), timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {job_queue.get(job_id)['status']}")
+
+def test_submit_runs_the_handler(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_queue.register('enroll', lambda user_id, value: {'user': user_id, 'value': value * 2})
+
+    job = wait_for(job_queue, job_queue.submit('enroll', '42', value=21))
+    assert job['status'] == SUCCEEDED
+    assert job['result'] == {'user': '42', 'value': 42}
+    job_queue.shutdown()
+
+def test_failed_job_keeps_the_error(tmp_path):
+    def fail(user_id):
+        raise ValueError("The video quality is not good enough")
+
+    job_queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_queue.register('enroll', fail)
+    job = wait_for(job_queue, job_queue.submit('enroll', '42'))
+    assert job['status'] == FAILED
+    assert job['error'] == "The video quality is not good enough"
+    job_queue.shutdown()
+
+def test_queued_job_is_replaced_and_its_payload_discarded(tmp_path):
+    release = threading.Event()
+    seen = []
+    discarded = []
+
+    def handler(user_id, path):
+        if user_id == 'blocker':
+            release.wait(10)
+        seen.append((user_id, path))
+
+    job_queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_queue.register('enroll', handler, discard=lambda user_id, path: discarded.append(path))
+    # The only worker is busy, so the jobs for user 42 stay queued
+    blocker = job_queue.submit('enroll', 'blocker', path='b')
+    first = job_queue.submit('enroll', '42', path='first.mp4')
+    second = job_queue.submit('enroll', '42', path='second.mp4')
+    assert first == second
+    assert discarded == ['first.mp4']
+
+    release.set()
+    wait_for(job_queue, blocker)
+    assert wait_for(job_queue, first)['payload'] == {'path': 'second.mp4'}
+    assert seen == [('blocker', 'b'), ('42', 'second.mp4')]
+    job_queue.shutdown()
+
+def test_jobs_of_one_user_do_not_overlap(tmp_path):
+    lock = threading.Lock()
+    running = {}
+    overlaps = []
+    release = threading.Event()
+
+    def handler(user_id, index):
+        with lock:
+            running[user_id] = running.get(user_id, 0) + 1
+            overlaps.append(running[user_id])
+        release.wait(10)
+        with lock:
+            running[user_id] -= 1
+
+    job_queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), max_workers=4)
+    job_queue.register('enroll', handler)
+    first = job_queue.submit('enroll', '42', index=0)
+    wait_for(job_queue, first, statuses=(RUNNING,))
+    # A new upload while the first job runs gets its own job, which waits for the first
+    second = job_queue.submit('enroll', '42', index=1)
+    other = job_queue.submit('enroll', '7', index=2)
+    wait_for(job_queue, other, statuses=(RUNNING,))
+    assert second != first
+    assert job_queue.get(second)['status'] == QUEUED
+
+    release.set()
+    for job_id in (first, second, other):
+        assert wait_for(job_queue, job_id)['status'] == SUCCEEDED
+    assert max(overlaps) == 1
+    job_queue.shutdown()
+
+def test_resume_requeues_interrupted_jobs(tmp_path):
+    database_path = str(tmp_path / 'jobs.sqlite3')
+    job_queue = JobQueue(database_path)
+    job_queue.register('enroll', lambda user_id: None)
+    job_queue.shutdown()
+
+    # A job that was running when the process stopped
+    with sqlite3.connect(database_path) as connection:
+        connection.execute("INSERT INTO jobs (id, kind, user_id, status, payload, created_at, started_at) "
+                           "VALUES ('interrupted', 'enroll', '42', ?, '{}', 0, 0)", (RUNNING,))
+    connection.close()
+
+    resumed = JobQueue(database_path)
+    resumed.register('enroll', lambda user_id: 'done')
+    assert resumed.resume() == 1
+    job = wait_for(resumed, 'interrupted')
+    assert job['status'] == SUCCEEDED
+    assert job['result'] == 'done'
+    resumed.shutdown()
+
+def test_queues_sharing_a_database_run_every_job_once(tmp_path):
+    database_path = str(tmp_path / 'jobs.sqlite3')
+    lock = threading.Lock()
+    runs = []
+    running = [0]
+    overlaps = []
+
+    def handler(user_id, index):
+        with lock:
+            runs.append(index)
+            running[0] += 1
+            overlaps.append(running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    # Two processes, e.g. gunicorn workers, each with its own pool
+    first = JobQueue(database_path, max_workers=2)
+    second = JobQueue(database_path, max_workers=2)
+    for job_queue in (first, second):
+        job_queue.register('enroll', handler)
+    job_ids = [first.submit('enroll', str(index % 3), index=index) for index in range(3)]
+    job_ids += [second.submit('enroll', str(index % 3) + 'b', index=index) for index in range(3, 6)]
+    # Every queued job is offered to both of them
+    first.resume()
+    second.resume()
+
+    for job_id in job_ids:
+        assert wait_for(first, job_id)['status'] == SUCCEEDED
+    assert sorted(runs) == list(range(6))
+    # max_workers bounds the running jobs of both queues together
+    assert max(overlaps) <= 2
+    first.shutdown()
+    second.shutdown()
+
+def test_resume_leaves_jobs_of_live_queues_running(tmp_path):
+    database_path = str(tmp_path / 'jobs.sqlite3')
+    release = threading.Event()
+    runs = []
+
+    def handler(user_id):
+        runs.append(user_id)
+        release.wait(10)
+
+    first = JobQueue(database_path, max_workers=2)
+    first.register('enroll', handler)
+    job_id = first.submit('enroll', '42')
+    wait_for(first, job_id, statuses=(RUNNING,))
+
+    # A second worker starting up must neither requeue nor run the job again
+    second = JobQueue(database_path, max_workers=2)
+    second.register('enroll', handler)
+    second.resume()
+    # Another job of the same user waits for the running one, whichever queue has it
+    other = second.submit('enroll', '42')
+    time.sleep(0.1)
+    assert second.get(job_id)['status'] == RUNNING
+    assert second.get(other)['status'] == QUEUED
+    assert runs == ['42']
+
+    release.set()
+    assert wait_for(second, other)['status'] == SUCCEEDED
+    assert runs == ['42', '42']
+    first.shutdown()
+    second.shutdown()
+
+def test_stale_running_job_is_requeued(tmp_path):
+    database_path = str(tmp_path / 'jobs.sqlite3')
+    job_queue = JobQueue(database_path, max_workers=2, stale_seconds=60)
+    job_queue.register('enroll', lambda user_id: 'done')
+    with sqlite3.connect(database_path) as connection:
+        connection.execute("INSERT INTO jobs (id, kind, user_id, status, payload, created_at, started_at, owner, "
+                           "heartbeat) VALUES ('dead', 'enroll', '42', ?, '{}', 0, 0, 'gone:1', ?)",
+                           (RUNNING, time.time() - 120))
+        connection.execute("INSERT INTO jobs (id, kind, user_id, status, payload, created_at, started_at, owner, "
+                           "heartbeat) VALUES ('alive', 'enroll', '7', ?, '{}', 0, 0, 'other:1', ?)",
+                           (RUNNING, time.time()))
+    connection.close()
+
+    assert job_queue.resume() == 1
+    assert wait_for(job_queue, 'dead')['result'] == 'done'
+    assert job_queue.get('alive')['status'] == RUNNING
+    job_queue.shutdown()
@@ -0,0 +1,59 @@
+import re
+import metrics
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (-?[0-9.e+-]+|\+Inf|NaN)$')
+
+def parse(text):
+    # Checks the Prometheus text format and returns {metric family: type}
+    types = {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert name not in types, f"{name} declared twice"
+            types[name] = kind
+        elif line.startswith('# HELP ') or not line:
+            continue
+        else:
+            match = SAMPLE.match(line)
+            assert match, f"Malformed sample {line!r}"
+            name = match.group(1)
+            family = re.sub(r'_(bucket|sum|count)$', '', name) if name not in types else name
+            assert family in types, f"{name} has no TYPE"
+    return types
+
+def test_counters_and_gauges(monkeypatch):
+    monkeypatch.setattr(metrics, '_gauges', [])
+    metrics.register_gauges('test_cache', lambda: {'hits': 3, 'models': 2, 'sizes': {1: 2}, 'ready': True},
+                            counters=('hits',))
+    text = metrics.render()
+    types = parse(text)
+    assert types['test_cache_hits_total'] == 'counter'
+    assert types['test_cache_models'] == 'gauge'
+    assert 'test_cache_hits_total 3' in text.splitlines()
+    assert 'test_cache_hits' not in types and 'test_cache_sizes' not in types and 'test_cache_ready' not in types
+
+def test_metrics_endpoint(main):
+    client = main.app.test_client()
+    client.get('/inference/stats')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    types = parse(response.get_data(as_text=True))
+
+    assert types['face_stage_seconds'] == 'histogram'
+    assert types['face_http_request_seconds'] == 'histogram'
+    for name in ('face_model_cache_hits', 'face_model_cache_misses', 'face_model_cache_evictions',
+                 'face_detection_calls', 'face_inference_requests', 'face_inference_batches'):
+        assert types[name + '_total'] == 'counter'
+    for name in ('face_model_cache_models', 'face_model_cache_bytes', 'face_detection_mean_ms',
+                 'face_inference_p99_ms'):
+        assert types[name] == 'gauge'
+    # Every monotonic value is a counter
+    assert not [name for name, kind in types.items() if kind == 'counter' and not name.endswith('_total')]
+
+def test_peak_rss_grows_with_allocations():
+    before = metrics.peak_rss_mb()
+    assert before > 0
+    buffer = b'x' * (64 * 1024 * 1024)
+    assert metrics.peak_rss_mb() >= before + 32
+    del buffer
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+from benchmark import rotate_image_loop
+from model import rotate_image
+
+ANGLES = [0, 10, -20, 45, 90, 135, 180, 270.5]
+
+def rotate_image_bilinear_loop(image, angle):
+    # Per-pixel bilinear reference, pixels outside the source count as zero
+    angle = np.deg2rad(angle)
+    cos_theta, sin_theta = np.cos(angle), np.sin(angle)
+    height, width = image.shape[:2]
+    new_width = int(np.abs(height * sin_theta) + np.abs(width * cos_theta))
+    new_height = int(np.abs(height * cos_theta) + np.abs(width * sin_theta))
+    new_image = np.zeros((new_height, new_width, image.shape[2]), dtype=np.float64)
+
+    for i in range(new_height):
+        for j in range(new_width):
+            y, x = i - new_height // 2, j - new_width // 2
+            old_x = x * cos_theta + y * sin_theta + width // 2
+            old_y = -x * sin_theta + y * cos_theta + height // 2
+            x0, y0 = int(np.floor(old_x)), int(np.floor(old_y))
+            dx, dy = old_x - x0, old_y - y0
+            for oy, ox, weight in ((0, 0, (1 - dx) * (1 - dy)), (0, 1, dx * (1 - dy)),
+                                   (1, 0, (1 - dx) * dy), (1, 1, dx * dy)):
+                if 0 <= x0 + ox < width and 0 <= y0 + oy < height:
+                    new_image[i, j] += image[y0 + oy, x0 + ox] * weight
+    return new_image
+
+@pytest.mark.parametrize('angle', ANGLES)
+@pytest.mark.parametrize('cache', [True, False])
+def test_nearest_matches_loop(angle, cache):
+    image = np.random.default_rng(0).integers(0, 256, (32, 24, 1), dtype=np.uint8)
+    np.testing.assert_array_equal(rotate_image(image, angle, cache=cache), rotate_image_loop(image, angle))
+
+@pytest.mark.parametrize('angle', ANGLES)
+def test_nearest_matches_loop_for_float_channels(angle):
+    image = np.random.default_rng(1).random((20, 20, 3), dtype=np.float32)
+    np.testing.assert_array_equal(rotate_image(image, angle), rotate_image_loop(image, angle))
+
+@pytest.mark.parametrize('angle', ANGLES)
+def test_bilinear_matches_loop(angle):
+    image = np.random.default_rng(2).random((16, 12, 1), dtype=np.float32)
+    np.testing.assert_allclose(rotate_image(image, angle, mode='bilinear'), rotate_image_bilinear_loop(image, angle),
+                               rtol=1e-5, atol=1e-6)
+
+def test_bilinear_rounds_and_clips_integers():
+    image = np.full((16, 16, 1), 255, dtype=np.uint8)
+    rotated = rotate_image(image, 30, mode='bilinear')
+    assert rotated.dtype == np.uint8
+    np.testing.assert_array_equal(rotated, np.clip(np.rint(rotate_image_bilinear_loop(image, 30)), 0, 255))
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        rotate_image(np.zeros((8, 8, 1)), 10, mode='bicubic')
+
+def test_fan_out_variants_are_not_augmented_again():
+    from model import DataGenerator, augment_variant
+
+    images = np.random.default_rng(3).random((10, 64, 64, 1), dtype=np.float32)
+    labels = np.arange(10)
+    generator = DataGenerator(images, labels, batch_size=5, augment=True, seed=0, fan_out=3)
+    for step in range(len(generator)):
+        batch_images, batch_labels = generator[step]
+        sources, variants = np.divmod(generator.indices[step * 5:(step + 1) * 5], 3)
+        np.testing.assert_array_equal(batch_labels, labels[sources])
+        for image, source, variant in zip(batch_images, sources, variants):
+            if variant in (0, 2):
+                # The source itself and the mirrored variant are deterministic
+                np.testing.assert_array_equal(image, augment_variant(images[source], variant))
+
+def test_augmented_batches_report_to_metrics():
+    import metrics
+    from model import DataGenerator
+
+    before = metrics.stage_seconds.series.get(('augmentation',), [None, 0.0, 0])[2]
+    images = np.zeros((4, 64, 64, 1), dtype=np.float32)
+    generator = DataGenerator(images, np.zeros(4), batch_size=4, seed=0, fan_out=2)
+    for step in range(len(generator)):
+        generator[step]
+    assert generator.augmented_count == 8
+    assert metrics.stage_seconds.series[('augmentation',)][2] == before + 2
+    # Plain validation batches are not augmentation
+    DataGenerator(images, np.zeros(4), batch_size=4)[0]
+    assert metrics.stage_seconds.series[('augmentation',)][2] == before + 2
+
+def test_epoch_timer_keeps_epoch_times():
+    import metrics
+    from model import EpochTimer, create_model
+
+    before = metrics.stage_seconds.series.get(('training_epoch',), [None, 0.0, 0])[2]
+    model = create_model((3, 3), 2)
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy')
+    timer = EpochTimer()
+    images, labels = np.zeros((4, 64, 64, 1), dtype=np.float32), np.zeros(4)
+    model.fit(images, labels, epochs=2, callbacks=[timer], verbose=0)
+    assert len(timer.times) == 2 and all(seconds > 0 for seconds in timer.times)
+    assert metrics.stage_seconds.series[('training_epoch',)][2] == before + 2
+    # A second fit starts over
+    model.fit(images, labels, epochs=1, callbacks=[timer], verbose=0)
+    assert len(timer.times) == 1
+
+def test_drop_remainder_is_independent_of_augmentation():
+    from model import DataGenerator
+
+    images = np.zeros((10, 64, 64, 1), dtype=np.float32)
+    labels = np.zeros(10)
+    assert len(DataGenerator(images, labels, batch_size=4)) == 3
+    assert len(DataGenerator(images, labels, batch_size=4, augment=True)) == 3
+    assert len(DataGenerator(images, labels, batch_size=4, drop_remainder=True)) == 2
+    assert len(DataGenerator(images, labels, batch_size=4, augment=True, drop_remainder=True)) == 2
+    # Validation with a batch size above the set size still yields one batch
+    assert len(DataGenerator(images, labels, batch_size=32)) == 1
+
+def test_embedding_output_stays_float32_under_mixed_precision():
+    import tensorflow as tf
+    from embedding import create_embedding_model
+
+    tf.keras.mixed_precision.set_global_policy('mixed_float16')
+    try:
+        model = create_embedding_model()
+        model.build((None, 64, 64, 1))
+        output = model(np.random.default_rng(0).random((2, 64, 64, 1), dtype=np.float32))
+    finally:
+        tf.keras.mixed_precision.set_global_policy('float32')
+    assert output.dtype == tf.float32
+    np.testing.assert_allclose(np.linalg.norm(output.numpy(), axis=1), 1.0, rtol=1e-5)
+
+def test_warm_start_uses_the_architecture_a_sweep_kept(tmp_path):
+    from model import DEFAULT_ARCHITECTURE, create_model, load_architecture, save_architecture, warm_start_model
+
+    user_directory = str(tmp_path / '42')
+    assert load_architecture(user_directory) == DEFAULT_ARCHITECTURE
+    save_architecture(user_directory, (5, 5), 16, 0.4)
+    architecture = load_architecture(user_directory)
+    assert architecture == {'kernel_size': (5, 5), 'width': 16, 'dropout': 0.4}
+
+    previous = create_model((5, 5), 2, 16, 0.4)
+    previous.save(f'{user_directory}_face_model.keras')
+    model = warm_start_model(architecture['kernel_size'], 2, [f'{user_directory}_face_model.keras'],
+                             architecture['width'], architecture['dropout'])
+    assert model is not None
+    for layer, source in zip(model.layers, previous.layers):
+        for weights, source_weights in zip(layer.get_weights(), source.get_weights()):
+            np.testing.assert_array_equal(weights, source_weights)
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+from model_registry import ModelRegistry
+
+class FakeModel:
+    input_shape = (None, 64, 64, 1)
+
+    def __init__(self, path, nbytes):
+        self.path = path
+        self.nbytes = nbytes
+        self.predictions = 0
+
+    def predict(self, images, verbose=0):
+        self.predictions += 1
+        return np.zeros((len(images), 2), dtype=np.float32)
+
+def make_registry(tmp_path, loads, **kwargs):
+    def loader(path):
+        loads.append(os.path.basename(path))
+        return FakeModel(path, 100)
+    for name in 'abcd':
+        (tmp_path / f'{name}.keras').write_bytes(b'model')
+    return ModelRegistry(loader=loader, **kwargs)
+
+def test_cached_models_are_reused_and_warmed_up(tmp_path):
+    loads = []
+    registry = make_registry(tmp_path, loads)
+    model = registry.get(str(tmp_path / 'a.keras'))
+    assert registry.get(str(tmp_path / 'a.keras')) is model
+    assert loads == ['a.keras']
+    assert model.predictions == 1
+    assert registry.stats()['hits'] == 1 and registry.stats()['misses'] == 1
+
+def test_least_recently_used_model_is_evicted(tmp_path):
+    loads = []
+    registry = make_registry(tmp_path, loads, max_models=2)
+    registry.get(str(tmp_path / 'a.keras'))
+    registry.get(str(tmp_path / 'b.keras'))
+    registry.get(str(tmp_path / 'a.keras'))
+    registry.get(str(tmp_path / 'c.keras'))
+
+    assert set(registry.entries) == {str(tmp_path / 'a.keras'), str(tmp_path / 'c.keras')}
+    assert registry.stats()['evictions'] == 1
+    registry.get(str(tmp_path / 'b.keras'))
+    assert loads == ['a.keras', 'b.keras', 'c.keras', 'b.keras']
+
+def test_byte_budget_evicts_but_keeps_the_newest(tmp_path):
+    loads = []
+    registry = make_registry(tmp_path, loads, max_bytes=250)
+    for name in 'abc':
+        registry.get(str(tmp_path / f'{name}.keras'))
+    assert registry.total_bytes() == 200
+    assert list(registry.entries) == [str(tmp_path / 'b.keras'), str(tmp_path / 'c.keras')]
+
+    registry = make_registry(tmp_path, loads, max_bytes=50)
+    registry.get(str(tmp_path / 'a.keras'))
+    assert len(registry.entries) == 1
+
+def test_changed_file_is_reloaded(tmp_path):
+    loads = []
+    registry = make_registry(tmp_path, loads)
+    path = tmp_path / 'a.keras'
+    first = registry.get(str(path))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert registry.get(str(path)) is not first
+    assert registry.stats()['invalidations'] == 1
+    assert len(registry.entries) == 1
+
+def test_eviction_listeners_see_every_dropped_model(tmp_path):
+    loads = []
+    dropped = []
+    registry = make_registry(tmp_path, loads, max_models=1)
+    registry.add_eviction_listener(lambda model: dropped.append(os.path.basename(model.path)))
+    registry.get(str(tmp_path / 'a.keras'))
+    registry.get(str(tmp_path / 'b.keras'))
+    assert dropped == ['a.keras']
+
+    path = tmp_path / 'b.keras'
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    registry.get(str(path))
+    assert dropped == ['a.keras', 'b.keras']
+
+    registry.invalidate()
+    assert dropped == ['a.keras', 'b.keras', 'b.keras']
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+from quality import FaceSelector, select_faces
+
+def face(seed, blur=0):
+    # A random pattern is sharp and mid-grey, every seed gives a distinct hash
+    image = np.random.default_rng(seed).integers(60, 200, (16, 16), dtype=np.uint8)
+    image = cv2.resize(image, (96, 96), interpolation=cv2.INTER_NEAREST)
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+def test_blurry_and_badly_exposed_crops_are_rejected():
+    selector = FaceSelector(10)
+    assert selector.offer(face(0))
+    assert not selector.offer(face(1, blur=8))
+    # Sharp checkerboards that are too dark and too bright
+    checkerboard = np.indices((12, 12)).sum(axis=0) % 2
+    checkerboard = cv2.resize(checkerboard.astype(np.uint8), (96, 96), interpolation=cv2.INTER_NEAREST)
+    for low, high in ((0, 60), (190, 255)):
+        crop = np.where(checkerboard, high, low).astype(np.uint8)
+        assert not selector.offer(cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR))
+    assert selector.stats() == {'offered': 4, 'accepted': 1, 'distinct': 0, 'blurry': 1, 'badly_exposed': 2}
+
+def test_the_sharpest_of_near_duplicates_is_kept():
+    selector = FaceSelector(2)
+    sharp = face(0)
+    softer = cv2.GaussianBlur(sharp, (0, 0), 0.6)
+    for crop in (softer, sharp, face(1)):
+        assert selector.offer(crop)
+    faces = selector.faces()
+    assert len(faces) == 2 and selector.distinct == 2
+    assert faces[0] is sharp
+    assert faces[1] is selector.crops[2]
+
+def test_remaining_room_is_spread_over_the_video():
+    # One face repeated: a single distinct crop, the rest are picked evenly
+    crops = [face(0)] * 9
+    selector = FaceSelector(3)
+    for crop in crops:
+        selector.offer(crop)
+    assert len(selector.faces()) == 3
+    assert selector.distinct == 1
+
+def test_select_faces_keeps_offer_order():
+    crops = [face(seed) for seed in range(6)]
+    faces = select_faces(iter(crops), 4)
+    assert len(faces) == 4
+    positions = [next(index for index, crop in enumerate(crops) if crop is selected) for selected in faces]
+    assert positions == sorted(positions)
+    assert select_faces(iter([]), 4) == []
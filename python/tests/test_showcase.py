@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+import showcase
+
+class FakeRegistry:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get(self, path):
+        self.calls.append('get')
+        return object()
+
+def test_tflite_fallback_sets_keras_up_first(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'faces').mkdir()
+    (tmp_path / 'faces' / '42_face_model.keras').write_bytes(b'model')
+    calls = []
+    monkeypatch.setattr(showcase, 'registry', FakeRegistry(calls))
+    monkeypatch.setattr(showcase, 'extract_face', lambda image: None)
+
+    result = showcase.main('42', b'image', backend='tflite', load_keras=lambda: calls.append('load_keras'))
+    assert calls == ['load_keras', 'get']
+    assert result == {"error": "No face image to display.", "success": False}
+
+def test_undecodable_uploads_give_no_image():
+    for data in (b'', b'not an image', bytearray(b'\xff\xd8\xff broken jpeg'), memoryview(b'GIF89a')):
+        assert showcase.read_image(data) is None
+        assert showcase.extract_face(data) is None
+
+def test_uploaded_bytes_decode_like_the_file(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, (32, 48, 3), dtype=np.uint8)
+    path = str(tmp_path / 'probe.png')
+    cv2.imwrite(path, image)
+    with open(path, 'rb') as f:
+        decoded = showcase.read_image(f.read())
+    np.testing.assert_array_equal(decoded, image)
+    np.testing.assert_array_equal(showcase.read_image(path), image)
+
+def test_sample_image_while_the_class_folder_is_swapped(tmp_path):
+    folder = tmp_path / '42'
+    folder.mkdir()
+    cv2.imwrite(str(folder / 'face.png'), np.full((80, 80), 255, dtype=np.uint8))
+    image = showcase.load_sample_image_from_class(str(tmp_path), '42')
+    assert image.shape == (64, 64, 1) and image.max() == 1.0
+    # Between the two renames of replace_faces the folder does not exist
+    folder.rename(tmp_path / '42.old')
+    assert showcase.load_sample_image_from_class(str(tmp_path), '42') is None
@@ -0,0 +1,33 @@
+import os
+import pytest
+from storage import atomic_write
+
+def test_atomic_write_swaps_in_the_new_file(tmp_path):
+    path = tmp_path / 'model.keras'
+    path.write_text('old')
+    seen = []
+
+    def write(temporary_path):
+        # The target keeps its old content until the write is done
+        seen.append((temporary_path, path.read_text()))
+        with open(temporary_path, 'w') as f:
+            f.write('new')
+
+    atomic_write(str(path), write)
+    assert path.read_text() == 'new'
+    assert seen[0][0].endswith('.tmp.keras') and seen[0][1] == 'old'
+    assert os.listdir(tmp_path) == ['model.keras']
+
+def test_failed_write_leaves_the_old_file(tmp_path):
+    path = tmp_path / 'cache.npy'
+    path.write_text('old')
+
+    def write(temporary_path):
+        with open(temporary_path, 'w') as f:
+            f.write('half')
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(str(path), write)
+    assert path.read_text() == 'old'
+    assert os.listdir(tmp_path) == ['cache.npy']
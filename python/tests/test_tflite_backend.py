@@ -0,0 +1,61 @@
+import threading
+import numpy as np
+import pytest
+import tensorflow as tf
+from model import create_model, export_tflite
+from tflite_backend import TFLiteModel, tflite_path
+
+@pytest.fixture(scope='module')
+def exported(tmp_path_factory):
+    tf.keras.utils.set_random_seed(0)
+    model = create_model((3, 3), 2, width=8)
+    images = np.random.default_rng(0).random((8, 64, 64, 1), dtype=np.float32)
+    directory = tmp_path_factory.mktemp('tflite')
+    paths = {}
+    for quantization in ('float16', 'int8'):
+        paths[quantization] = str(directory / f'{quantization}.tflite')
+        export_tflite(model, paths[quantization], quantization, images)
+    return model, images, paths
+
+def test_float16_export_predicts_like_the_keras_model(exported):
+    model, images, paths = exported
+    tflite_model = TFLiteModel(paths['float16'])
+    assert tflite_model.input_shape == (None, 64, 64, 1)
+
+    expected = model.predict(images, verbose=0)
+    np.testing.assert_allclose(tflite_model.predict(images), expected, atol=1e-2)
+    # A different batch size resizes the interpreter's input
+    np.testing.assert_allclose(tflite_model.predict(images[:1]), expected[:1], atol=1e-2)
+    np.testing.assert_allclose(tflite_model.predict(images[:3]), expected[:3], atol=1e-2)
+
+def test_int8_export_stays_close(exported):
+    model, images, paths = exported
+    np.testing.assert_allclose(TFLiteModel(paths['int8']).predict(images), model.predict(images, verbose=0),
+                               atol=0.1)
+
+def test_every_thread_gets_its_own_interpreter(exported):
+    model, images, paths = exported
+    tflite_model = TFLiteModel(paths['float16'])
+    expected = model.predict(images, verbose=0)
+    interpreters = []
+    errors = []
+
+    def predict(batch_size):
+        try:
+            interpreters.append(tflite_model._interpreter())
+            for _ in range(20):
+                np.testing.assert_allclose(tflite_model.predict(images[:batch_size]), expected[:batch_size],
+                                           atol=1e-2)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=predict, args=(batch_size,)) for batch_size in (1, 3, 8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len({id(interpreter) for interpreter in interpreters}) == 3
+
+def test_tflite_path():
+    assert tflite_path('faces/42_face_model.keras') == 'faces/42_face_model.tflite'
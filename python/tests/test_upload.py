@@ -0,0 +1,108 @@
+import io
+import os
+import cv2
+import numpy as np
+import pytest
+
+@pytest.fixture(autouse=True)
+def streaming(main, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'STREAMING_UPLOAD', True)
+    monkeypatch.setitem(main.app.config, 'SELECTED_FACES', 0)
+
+def upload(main, data):
+    return main.app.test_client().post('/users/uploadVideo', data=data, content_type='multipart/form-data')
+
+def staged_files(main):
+    return [name for name in os.listdir(main.app.config['UPLOAD_FOLDER']) if name.endswith('_faces.npz')]
+
+def fake_stage_faces(count, spools):
+    def stage_faces(spool, faces_path, **kwargs):
+        spools.append(spool)
+        # Read the whole upload like the decoder would
+        while spool.read(4096):
+            pass
+        np.savez(faces_path, *[np.zeros((80, 80, 3), dtype=np.uint8)] * count)
+        return count
+    return stage_faces
+
+def test_failed_extraction_is_a_bad_upload(main, monkeypatch):
+    spools = []
+
+    def stage_faces(spool, faces_path, **kwargs):
+        spools.append(spool)
+        raise ValueError("Could not decode the video")
+
+    monkeypatch.setattr(main, 'stage_faces', stage_faces)
+    response = upload(main, {'userId': '42', 'file': (io.BytesIO(b'not a video' * 1000), 'v.mp4')})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': "Video could not be uploaded"}
+    assert spools[0].closed
+    assert staged_files(main) == []
+
+def test_too_few_faces_discard_the_staged_faces(main, monkeypatch):
+    spools = []
+    monkeypatch.setattr(main, 'stage_faces', fake_stage_faces(10, spools))
+    response = upload(main, {'userId': '42', 'file': (io.BytesIO(b'video' * 1000), 'v.mp4')})
+    assert response.status_code == 400
+    assert spools[0].closed
+    assert staged_files(main) == []
+
+def test_missing_user_id_discards_the_staged_faces(main, monkeypatch):
+    monkeypatch.setattr(main, 'stage_faces', fake_stage_faces(300, []))
+    response = upload(main, {'file': (io.BytesIO(b'video' * 1000), 'v.mp4')})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': "User ID and video file are required"}
+    assert staged_files(main) == []
+
+def test_enough_faces_queue_an_enrolment(main, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(main, 'stage_faces', fake_stage_faces(300, []))
+    monkeypatch.setattr(main.job_queue, 'submit', lambda kind, user_id, **payload: submitted.append(payload) or 'job')
+    response = upload(main, {'userId': '42', 'file': (io.BytesIO(b'video' * 1000), 'v.mp4')})
+    assert response.status_code == 202
+    assert response.get_json()['jobId'] == 'job'
+    faces_path = submitted[0]['faces_path']
+    assert len(main.load_staged_faces(faces_path)) == 300
+
+    main.discard_enrollment('42', faces_path=faces_path)
+    assert staged_files(main) == []
+
+def stage(tmp_path, count):
+    faces_path = str(tmp_path / 'faces.npz')
+    rng = np.random.default_rng(0)
+    np.savez(faces_path, *[rng.integers(0, 256, (80, 80, 3), dtype=np.uint8) for _ in range(count)])
+    return faces_path
+
+def wait_for_archive():
+    # The archive thread runs the swap before it picks up the next task
+    from video import _archive_executor
+    _archive_executor.submit(lambda: None).result()
+
+def enrolled_faces(main, user_id):
+    return sorted(os.listdir(os.path.join(main.app.config['FACES_FOLDER'], user_id)))
+
+def test_failed_enrolment_keeps_the_previous_faces(main, tmp_path):
+    user_dir = os.path.join(main.app.config['FACES_FOLDER'], 'kept')
+    os.makedirs(user_dir)
+    cv2.imwrite(os.path.join(user_dir, 'face_0000.jpg'), np.zeros((80, 80, 3), dtype=np.uint8))
+
+    with pytest.raises(ValueError):
+        main.enroll_user('kept', faces_path=stage(tmp_path, 10))
+    wait_for_archive()
+    assert enrolled_faces(main, 'kept') == ['face_0000.jpg']
+    assert not [name for name in os.listdir(main.app.config['FACES_FOLDER']) if name.startswith('.kept')]
+
+def test_enrolment_swaps_in_the_new_faces(main, tmp_path, monkeypatch):
+    user_dir = os.path.join(main.app.config['FACES_FOLDER'], 'swapped')
+    os.makedirs(user_dir)
+    for index in range(300):
+        cv2.imwrite(os.path.join(user_dir, f'face_{index:04d}.jpg'), np.zeros((80, 80, 3), dtype=np.uint8))
+    trained = []
+    monkeypatch.setattr(main, 'load_tensorflow', lambda: None)
+    monkeypatch.setattr(main, 'train_model', lambda user_id, faces, **kwargs: trained.append(faces.shape))
+
+    main.enroll_user('swapped', faces_path=stage(tmp_path, 260))
+    wait_for_archive()
+    assert trained == [(260, 64, 64, 1)]
+    assert enrolled_faces(main, 'swapped') == [f'face_{index:04d}.jpg' for index in range(260)]
+    assert not [name for name in os.listdir(main.app.config['FACES_FOLDER']) if name.startswith('.swapped')]
@@ -0,0 +1,63 @@
+import io
+import threading
+import numpy as np
+from video import UploadSpool, load_staged_faces, preprocess_faces, stage_faces
+
+def test_spool_read_waits_for_data(tmp_path):
+    spool = UploadSpool(str(tmp_path))
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.append(spool.read(4)))
+    reader.start()
+    reader.join(0.1)
+    assert reader.is_alive()
+
+    spool.append(b'abcdef')
+    reader.join(5)
+    assert chunks == [b'abcd']
+    spool.finish()
+    assert spool.read() == b'ef'
+    assert spool.read(10) == b''
+    spool.close()
+
+def test_spool_drops_data_after_finish(tmp_path):
+    spool = UploadSpool(str(tmp_path))
+    spool.append(b'abc')
+    spool.finish()
+    spool.append(b'def')
+    assert spool.size == 3
+    assert spool.read() == b'abc'
+    spool.close()
+    assert spool.closed
+
+def test_spool_seek_end_uses_the_expected_size(tmp_path):
+    spool = UploadSpool(str(tmp_path), expected_size=100)
+    spool.append(b'abc')
+    assert spool.seek(0, io.SEEK_END) == 100
+    spool.finish()
+    assert spool.seek(-1, io.SEEK_END) == 2
+    assert spool.read() == b'c'
+    spool.close()
+
+def test_close_releases_a_blocked_reader(tmp_path):
+    spool = UploadSpool(str(tmp_path))
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.append(spool.read()))
+    reader.start()
+    spool.append(b'abc')
+    spool.close()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert chunks in ([b'abc'], [b''])
+
+def test_staged_faces_round_trip_losslessly(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    crops = [rng.integers(0, 256, (height, height, 3), dtype=np.uint8) for height in (80, 95, 120)]
+    monkeypatch.setattr('video.collect_face_crops', lambda *args, **kwargs: crops)
+
+    faces_path = str(tmp_path / 'faces.npz')
+    assert stage_faces('video.mp4', faces_path) == 3
+    staged = load_staged_faces(faces_path)
+    assert len(staged) == 3
+    for crop, staged_crop in zip(crops, staged):
+        np.testing.assert_array_equal(crop, staged_crop)
+    assert preprocess_faces(staged).shape == (3, 64, 64, 1)
@@ -0,0 +1,67 @@
+import os
+import threading
+import numpy as np
+from model_registry import ModelRegistry
+
+# Lightweight inference backend for exported face models. It only needs the TFLite
+# interpreter: ai-edge-litert or tflite-runtime when installed, TensorFlow's bundled
+# interpreter otherwise.
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+
+class TFLiteModel:
+    # Mirrors the parts of the Keras model API that verification uses (predict and
+    # input_shape). Interpreters are not thread-safe, so each thread gets its own.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.model_content = f.read()
+        self.nbytes = len(self.model_content)
+        self.local = threading.local()
+
+        interpreter = self._interpreter()
+        self.input_shape = tuple(interpreter.get_input_details()[0]['shape_signature'])
+        self.input_shape = (None,) + self.input_shape[1:]
+
+    def _interpreter(self):
+        interpreter = getattr(self.local, 'interpreter', None)
+        if interpreter is None:
+            interpreter = Interpreter(model_content=self.model_content)
+            interpreter.allocate_tensors()
+            self.local.interpreter = interpreter
+            self.local.batch_size = None
+        return interpreter
+
+    def predict(self, images, verbose=0):
+        interpreter = self._interpreter()
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        images = np.asarray(images, dtype=np.float32)
+
+        if self.local.batch_size != len(images):
+            interpreter.resize_tensor_input(input_details['index'], [len(images)] + list(images.shape[1:]))
+            interpreter.allocate_tensors()
+            self.local.batch_size = len(images)
+
+        # Fully integer models take quantized inputs and produce quantized outputs
+        scale, zero_point = input_details['quantization']
+        if scale:
+            images = np.round(images / scale + zero_point).astype(input_details['dtype'])
+        interpreter.set_tensor(input_details['index'], images)
+        interpreter.invoke()
+
+        outputs = interpreter.get_tensor(output_details['index'])
+        scale, zero_point = output_details['quantization']
+        if scale:
+            outputs = (outputs.astype(np.float32) - zero_point) * scale
+        return outputs
+
+def tflite_path(model_path):
+    return f"{os.path.splitext(model_path)[0]}.tflite"
+
+registry = ModelRegistry(loader=TFLiteModel)
@@ -1,76 +1,295 @@
 import cv2
+import io
 import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dataset import IMAGE_SIZE, preprocess_face
+from face_detection import FaceTracker, detect_faces, get_executor
+import metrics
+from quality import select_faces
 
-def split_video_into_faces(video_path, output_dir, frame_rate=1):
-    # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+class UploadSpool(io.BufferedIOBase):
+    # Temp file an upload is appended to while the video decoder already reads from it.
+    # Reads past the data received so far block until more arrives or the upload ends,
+    # so decoding of streamable containers (WebM, fragmented or faststart MP4) starts
+    # on the first frames. expected_size, an upper bound such as the request's
+    # Content-Length, answers FFmpeg's size query before the upload is complete.
+    def __init__(self, directory=None, expected_size=None):
+        super().__init__()
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.condition = threading.Condition()
+        self.expected_size = expected_size
+        self.size = 0
+        self.position = 0
+        self.complete = False
+
+    def append(self, data):
+        # Data arriving after finish() is dropped, the reader no longer wants it
+        with self.condition:
+            if self.complete:
+                return
+            self.file.seek(self.size)
+            self.file.write(data)
+            self.size += len(data)
+            self.condition.notify_all()
+
+    def finish(self):
+        # No more data will arrive or be read, readers see the end of the stream
+        with self.condition:
+            self.complete = True
+            self.condition.notify_all()
+
+    def __repr__(self):
+        return f"upload stream ({self.size} bytes received)"
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        with self.condition:
+            while not self.complete and (self.position >= self.size or size < 0):
+                self.condition.wait()
+            # A reader still blocked when the spool was closed sees the end of the stream
+            if self.file.closed:
+                return b''
+            self.file.seek(self.position)
+            data = self.file.read(min(size, self.size - self.position) if size >= 0 else -1)
+            self.position += len(data)
+            return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self.condition:
+            if whence == io.SEEK_END:
+                while not self.complete and self.expected_size is None:
+                    self.condition.wait()
+                end = self.size if self.complete else max(self.size, self.expected_size)
+                self.position = end + offset
+            elif whence == io.SEEK_CUR:
+                self.position += offset
+            else:
+                self.position = offset
+            return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        with self.condition:
+            self.complete = True
+            self.file.close()
+            self.condition.notify_all()
+        super().close()
+
+def _read_frames(cap, frame_step, frames, stop):
+    # Producer: frames that are not sampled are only grabbed, which skips their
+    # colour conversion and copy, sampled frames are retrieved and queued in order
+    frame_count = 0
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            if not cap.grab():
+                break
+
+            # Check if the current frame should be processed based on the desired frame rate
+            if frame_count % frame_step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                metrics.observe('video_decode', time.perf_counter() - start)
+                while not stop.is_set():
+                    try:
+                        frames.put((frame_count, frame), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+            frame_count += 1
+    finally:
+        frames.put(None)
+
+def _detect_frame(frame, tracker=None):
+    # Convert frame to grayscale as face detection works on grayscale images
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    if tracker is not None:
+        return frame, tracker.detect(gray)
+
+    # Detect faces with the shared per-thread detector
+    return frame, detect_faces(gray, min_neighbors=15)
+
+def iter_face_crops(video_path, frame_rate=150, max_faces=250, workers=None, fast=False):
+    # Yields the BGR face crops of a video in frame order, at most max_faces of them.
+    # video_path may also be an UploadSpool that is still being written.
+    start = time.perf_counter()
 
-    # Load the Haar Cascade for face detection
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
     # Open the video file
-    cap = cv2.VideoCapture(video_path)
-    
+    if isinstance(video_path, UploadSpool):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [])
+    else:
+        cap = cv2.VideoCapture(video_path)
+
     if not cap.isOpened():
         print(f"Error: Could not open video {video_path}")
         return
 
     # Get the original frame rate of the video
     original_fps = cap.get(cv2.CAP_PROP_FPS)
-    
+
     if original_fps <= 0:
         print(f"Error: Invalid frame rate {original_fps} for video {video_path}")
+        cap.release()
         return
-    
+
     if frame_rate <= 0:
         print(f"Error: Frame rate must be greater than zero")
+        cap.release()
         return
 
-    frame_count = 0
-    face_count = 0
+    workers = workers or os.cpu_count() or 1
+    # Frames handed to the detection pool at once, which bounds this video's share of it
+    max_pending = workers * 2
+    tracker = None
+    if fast:
+        # The tracker depends on the previous frame, so one frame is detected at a
+        # time, decoding still overlaps with it
+        tracker = FaceTracker()
+        workers = 1
+        max_pending = 1
+    frame_step = max(1, int(original_fps // frame_rate))
 
-    while True:
-        # Read a frame
-        ret, frame = cap.read()
+    # One thread decodes while the shared detection pool runs detection. The frame queue
+    # is bounded so decoding never runs more than a few frames ahead of detection.
+    frames = queue.Queue(maxsize=workers)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_frames, args=(cap, frame_step, frames, stop), daemon=True)
+    pending = deque()
+    face_count = 0
+    processed_frames = 0
+    first_face = None
 
-        # If the frame was not retrieved properly, break the loop
-        if not ret:
-            break
+    executor = get_executor()
+    reader.start()
+    try:
+        reading = True
+        while reading or pending:
+            # Keep the pool busy, then consume results strictly in frame order
+            while reading and len(pending) < max_pending:
+                item = frames.get()
+                if item is None:
+                    reading = False
+                    break
+                pending.append(executor.submit(_detect_frame, item[1], tracker))
 
-        # Check if the current frame should be processed based on the desired frame rate
-        if frame_count % max(1, int(original_fps // frame_rate)) == 0:
-            # Convert frame to grayscale as face detection works on grayscale images
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if not pending:
+                continue
 
-            # Detect faces
-            faces = face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,  # How much the image size is reduced at each image scale
-                minNeighbors=15,  # How many neighbors each candidate rectangle should have to retain it
-                minSize=(64, 64),  # Minimum possible object size
-                flags=cv2.CASCADE_SCALE_IMAGE
-            )
+            frame, faces = pending.popleft().result()
+            processed_frames += 1
 
             for (x, y, w, h) in faces:
-                # Crop the face region
-                face = frame[y:y+h, x:x+w]
-                
-                # Construct the output face file path
-                face_filename = os.path.join(output_dir, f"face_{face_count:04d}.jpg")
-                
-                # Save the face image
-                cv2.imwrite(face_filename, face)
+                # Crop the face region, copied so the crop does not keep the whole frame alive
                 face_count += 1
+                if first_face is None:
+                    first_face = time.perf_counter() - start
+                yield frame[y:y+h, x:x+w].copy()
+
+                # Stop if we have reached the maximum number of faces
+                if face_count >= max_faces:
+                    break
+
+            if face_count >= max_faces:
+                for future in pending:
+                    future.cancel()
+                break
+    finally:
+        # Stop the reader and let it finish before the capture object goes away. A reader
+        # waiting for more of an upload is released by ending the spool.
+        stop.set()
+        if isinstance(video_path, UploadSpool):
+            video_path.finish()
+        while reader.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        reader.join()
+
+        # Release the video capture object
+        cap.release()
+
+        elapsed = time.perf_counter() - start
+        first_face = f", first face after {first_face:.2f}s" if first_face is not None else ""
+        print(f"Found {face_count} faces in {video_path} "
+              f"({processed_frames} frames in {elapsed:.2f}s, {processed_frames / max(elapsed, 1e-9):.1f} fps{first_face})")
+
+@metrics.timer('jpeg_write')
+def _write_faces(faces, output_dir):
+    # Create the output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    for face_count, face in enumerate(faces):
+        # Construct the output face file path
+        face_filename = os.path.join(output_dir, f"face_{face_count:04d}.jpg")
+
+        # Save the face image
+        cv2.imwrite(face_filename, face)
+
+    print(f"Extracted {len(faces)} faces to {output_dir}")
+    return len(faces)
+
+def _report_archive(future):
+    if future.exception() is not None:
+        print(f"Error: Could not archive faces: {future.exception()}")
+
+def archive_faces(faces, output_dir):
+    # Writes the crops as JPEGs in the background and returns the Future of the write
+    future = _archive_executor.submit(_write_faces, faces, output_dir)
+    future.add_done_callback(_report_archive)
+    return future
+
+def collect_face_crops(video_path, frame_rate=150, max_faces=250, workers=None, fast=False, keep=None):
+    # With keep, only the sharpest distinct faces of the max_faces found are returned,
+    # at most keep of them
+    crops = iter_face_crops(video_path, frame_rate, max_faces, workers, fast)
+    if keep is None:
+        return list(crops)
+    return select_faces(crops, keep)
+
+def split_video_into_faces(video_path, output_dir, frame_rate=150, max_faces=250, workers=None, fast=False,
+                           keep=None):
+    faces = collect_face_crops(video_path, frame_rate, max_faces, workers, fast, keep)
+    return _write_faces(faces, output_dir)
+
+def stage_faces(video_path, faces_path, frame_rate=150, max_faces=250, workers=None, fast=False, keep=None):
+    # Keeps the crops for a later job in a single uncompressed .npz instead of JPEGs,
+    # so they are neither re-encoded nor decoded again. Returns the number of crops.
+    crops = collect_face_crops(video_path, frame_rate, max_faces, workers, fast, keep)
+    np.savez(faces_path, *crops)
+    return len(crops)
+
+def load_staged_faces(faces_path):
+    with np.load(faces_path) as staged:
+        return [staged[f'arr_{index}'] for index in range(len(staged.files))]
 
-        frame_count += 1
+def preprocess_faces(crops):
+    # The crops as a preprocessed (N, 64, 64, 1) batch ready for training, without the
+    # JPEG encode/decode round trip. Enrolment archives the crops with archive_faces.
+    return np.array([preprocess_face(crop) for crop in crops], dtype=np.float32).reshape(-1, *IMAGE_SIZE, 1)
 
-    # Release the video capture object
-    cap.release()
-    print(f"Extracted {face_count} faces to {output_dir}")
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive')
 
-# Example usage
-video_path = 'C:/Users/grego/Desktop/gregor.mp4'
-output_dir = 'C:/Users/grego/Desktop/faces'
-frame_rate = 10  # Process 10 frames per second
-split_video_into_faces(video_path, output_dir, frame_rate)
\ No newline at end of file
+if __name__ == '__main__':
+    # Example usage
+    video_path = 'C:/Users/grego/Desktop/gregor.mp4'
+    output_dir = 'C:/Users/grego/Desktop/faces'
+    frame_rate = 10  # Process 10 frames per second
+    split_video_into_faces(video_path, output_dir, frame_rate)